@@ -1,4 +1,16 @@
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
+
+from fastapi import HTTPException
 from passlib.context import CryptContext
+from starlette import status
+
+from app.config import settings
+from app.metrics import PASSWORD_HASH_PENDING, PASSWORD_HASH_WAIT
+from app.tracing import span
 
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
@@ -9,3 +21,86 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    candidates = {tag.strip() for tag in if_none_match.split(',')}
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def timed_call(func: Callable[..., Any], *args: Any) -> Tuple[float, Any]:
+    return time(), func(*args)
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: int, max_pending: int) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.pending: int = 0
+        self.wait_count: int = 0
+        self.wait_total: float = 0.0
+        self.wait_max: float = 0.0
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Too many password operations, try again later',
+                headers={'Retry-After': '1'},
+            )
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        self.pending += 1
+        submitted_at = time()
+        try:
+            with span('password_hash'):
+                started_at, result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, timed_call, func, *args
+                )
+        finally:
+            self.pending -= 1
+
+        wait = max(started_at - submitted_at, 0.0)
+        self.wait_count += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        PASSWORD_HASH_WAIT.observe(wait)
+        return result
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+password_hasher = PasswordHasher(
+    settings.password_hash_workers, settings.password_hash_queue_size
+)
+PASSWORD_HASH_PENDING.set_function(lambda: password_hasher.pending)
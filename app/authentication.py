@@ -4,14 +4,15 @@ from typing import Any, Dict, Optional
 from fastapi import Depends, HTTPException, Request, WebSocket
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
 from starlette import status
 
-from app.app_utils import verify_password
+from app.app_utils import password_hasher
+from app.cache import principal_cache
 from app.config import ALGORITHM, settings
 from app.db_models import RoleEnum, User
-from app.db_utils import get_session, get_user
-from app.pydantic_models import TokenData
+from app.db_utils import DbSession, get_session, get_user
+from app.pydantic_models import Principal, TokenData
+from app.tracing import span
 
 
 class CustomOAuth2PasswordBearer(OAuth2PasswordBearer):
@@ -22,10 +23,12 @@ class CustomOAuth2PasswordBearer(OAuth2PasswordBearer):
 oauth2_scheme = CustomOAuth2PasswordBearer(tokenUrl='token')
 
 
-def authenticate_user(session: Session, username: str, password: str) -> Optional[User]:
-    user = get_user(session, username)
+async def authenticate_user(
+    session: DbSession, username: str, password: str
+) -> Optional[User]:
+    user = await session.run_sync(get_user, username)
 
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or not await password_hasher.verify(password, user.hashed_password):
         return None
 
     return user
@@ -46,9 +49,13 @@ def create_access_token(
     return encoded_jwt
 
 
-def get_current_user(
-    session: Session = Depends(get_session), token: str = Depends(oauth2_scheme)
-) -> Optional[User]:
+async def get_current_user(
+    session: DbSession = Depends(get_session), token: str = Depends(oauth2_scheme)
+) -> Principal:
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='Could not validate credentials',
@@ -56,7 +63,8 @@ def get_current_user(
     )
 
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[ALGORITHM])
+        with span('auth.jwt_decode'):
+            payload = jwt.decode(token, settings.secret_key, algorithms=[ALGORITHM])
         username: str = payload.get('sub')
         if username is None:
             raise credentials_exception
@@ -64,14 +72,20 @@ def get_current_user(
     except JWTError as e:
         raise credentials_exception from e
 
-    user = get_user(session, token_data.username)
+    user = await session.run_sync(get_user, token_data.username)
     if user is None:
         raise credentials_exception
 
-    return user
+    principal = Principal(
+        id=user.id, username=user.username, role=user.role, full_name=user.full_name
+    )
+    principal_cache.put(token, payload, principal)
+    return principal
 
 
-def verify_role_admin(current_user: User = Depends(get_current_user)) -> User:
+def verify_role_admin(
+    current_user: Principal = Depends(get_current_user),
+) -> Principal:
     if current_user.role != RoleEnum.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,186 @@
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from app.config import EXPORT_CHUNK_SIZE, IMPORT_CHUNK_SIZE
+from app.db_models import Bot, Command, MatchTypeEnum, User
+from app.db_utils import DbSession, stream_partitions
+from app.pydantic_models import AddBotModel, CommandModel
+
+EXPORT_COLUMNS = ('command_id', 'command', 'response', 'match_type')
+
+
+def list_bots(
+    session: Session, name: Optional[str], after: int, limit: int
+) -> List[Tuple[int, str, str]]:
+    query = (
+        session.query(Bot.id, Bot.name, User.username)
+        .join(User, Bot.author_id == User.id)
+        .filter(Bot.id > after)
+    )
+    if name:
+        query = query.filter(
+            func.lower(Bot.name).contains(name.lower(), autoescape=True)
+        )
+    return query.order_by(Bot.id).limit(limit).all()
+
+
+def command_rows(bot_id: int, commands: List[CommandModel]) -> List[Dict[str, Any]]:
+    return [
+        {
+            'message': command.command,
+            'response': command.response,
+            'match_type': command.match_type,
+            'bot_id': bot_id,
+        }
+        for command in commands
+    ]
+
+
+def insert_bot(session: Session, bot_model: AddBotModel, author_id: int) -> int:
+    bot = Bot(
+        name=bot_model.name,
+        author_id=author_id,
+        history_size=bot_model.history_size,
+        message_retention_days=bot_model.message_retention_days,
+    )
+    session.add(bot)
+    session.flush()
+    return bot.id
+
+
+def insert_commands(session: Session, rows: List[Dict[str, Any]]) -> None:
+    if rows:
+        session.execute(insert(Command), rows)
+
+
+def create_bot(session: Session, bot_model: AddBotModel, author_id: int) -> int:
+    bot_id = insert_bot(session, bot_model, author_id)
+    insert_commands(session, command_rows(bot_id, bot_model.commands))
+    session.commit()
+    return bot_id
+
+
+def create_bots(
+    session: Session, bot_models: List[AddBotModel], author_id: int
+) -> Tuple[List[int], int]:
+    bot_ids: List[int] = []
+    rows: List[Dict[str, Any]] = []
+    imported_commands = 0
+    for bot_model in bot_models:
+        bot_id = insert_bot(session, bot_model, author_id)
+        bot_ids.append(bot_id)
+        rows += command_rows(bot_id, bot_model.commands)
+        while len(rows) >= IMPORT_CHUNK_SIZE:
+            insert_commands(session, rows[:IMPORT_CHUNK_SIZE])
+            imported_commands += IMPORT_CHUNK_SIZE
+            rows = rows[IMPORT_CHUNK_SIZE:]
+
+    insert_commands(session, rows)
+    session.commit()
+    return bot_ids, imported_commands + len(rows)
+
+
+def get_bot_name(session: Session, bot_id: int) -> str:
+    return session.query(Bot.name).filter_by(id=bot_id).scalar()
+
+
+def bump_commands_version(session: Session, bot_id: int) -> None:
+    session.query(Bot).filter_by(id=bot_id).update(
+        {Bot.commands_version: Bot.commands_version + 1}, synchronize_session=False
+    )
+
+
+def list_bot_commands(
+    session: Session, bot_id: int, prefix: Optional[str], cursor: int, limit: int
+) -> List[Dict[str, Any]]:
+    query = session.query(Command).filter(Command.bot_id == bot_id, Command.id > cursor)
+    if prefix:
+        query = query.filter(Command.message.startswith(prefix, autoescape=True))
+    commands = query.order_by(Command.id).limit(limit).all()
+    return [
+        {
+            'command_id': command.id,
+            'command': command.message,
+            'response': command.response,
+            'match_type': command.match_type,
+        }
+        for command in commands
+    ]
+
+
+def export_row(row: Row) -> Tuple[int, str, str, str]:
+    command_id, message, response, match_type = row
+    return command_id, message, response, match_type.value
+
+
+def encode_ndjson(rows: List[Tuple[Any, ...]]) -> bytes:
+    return ''.join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows
+    ).encode()
+
+
+def encode_csv(rows: List[Tuple[Any, ...]]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+EXPORT_FORMATS: Dict[str, Tuple[Callable[[List[Tuple[Any, ...]]], bytes], str]] = {
+    'ndjson': (encode_ndjson, 'application/x-ndjson'),
+    'csv': (encode_csv, 'text/csv'),
+}
+
+
+async def export_commands(
+    session: DbSession, bot_id: int, export_format: str
+) -> AsyncIterator[bytes]:
+    encode, _ = EXPORT_FORMATS[export_format]
+    if export_format == 'csv':
+        yield encode([EXPORT_COLUMNS])
+
+    statement = (
+        select(Command.id, Command.message, Command.response, Command.match_type)
+        .where(Command.bot_id == bot_id)
+        .order_by(Command.id)
+    )
+    async for partition in stream_partitions(session, statement, EXPORT_CHUNK_SIZE):
+        yield encode([export_row(row) for row in partition])
+
+
+def add_command(session: Session, bot_id: int, command_model: CommandModel) -> None:
+    command = Command(
+        message=command_model.command,
+        response=command_model.response,
+        match_type=command_model.match_type,
+        bot_id=bot_id,
+    )
+    session.add(command)
+    session.flush()
+    bump_commands_version(session, bot_id)
+    session.commit()
+
+
+def edit_command(
+    session: Session, command_id: int, response: str
+) -> Tuple[int, str, MatchTypeEnum]:
+    command = session.query(Command).filter_by(id=command_id).one()
+    command.response = response
+    result = command.bot_id, command.message, command.match_type
+    bump_commands_version(session, command.bot_id)
+    session.commit()
+    return result
+
+
+def delete_command(session: Session, command_id: int) -> Tuple[int, str]:
+    command = session.query(Command).filter_by(id=command_id).one()
+    result = command.bot_id, command.message
+    session.delete(command)
+    bump_commands_version(session, command.bot_id)
+    session.commit()
+    return result
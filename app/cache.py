@@ -0,0 +1,181 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from prometheus_client import REGISTRY
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db_models import Bot, Command, MatchTypeEnum
+from app.matching import CommandMatcher
+from app.metrics import CommandIndexCollector
+from app.pydantic_models import Principal
+
+
+class CommandIndex:
+    def __init__(self) -> None:
+        self.bots: Dict[int, CommandMatcher] = {}
+        self.versions: Dict[int, int] = {}
+        self.generations: Dict[int, int] = {}
+        self.published: Dict[int, Set[int]] = {}
+        self.commands_versions: Dict[int, Tuple[str, int]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, bot_id: int) -> Optional[CommandMatcher]:
+        matcher = self.bots.get(bot_id)
+        if matcher is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return matcher
+
+    def load(self, session: Session, bot_id: int) -> CommandMatcher:
+        generation = self.generations.get(bot_id, 0)
+        rows = (
+            session.query(Command.message, Command.match_type, Command.response)
+            .filter_by(bot_id=bot_id)
+            .all()
+        )
+        matcher = CommandMatcher(rows)
+        matcher.compile()
+        if self.generations.get(bot_id, 0) == generation:
+            self.bots[bot_id] = matcher
+        return matcher
+
+    def load_commands_version(
+        self, session: Session, bot_id: int
+    ) -> Tuple[Optional[str], int]:
+        generation = self.generations.get(bot_id, 0)
+        row = session.query(Bot.name, Bot.commands_version).filter_by(id=bot_id).first()
+        if row is None:
+            return None, 0
+        if self.generations.get(bot_id, 0) == generation:
+            self.commands_versions[bot_id] = (row.name, row.commands_version)
+        return row.name, row.commands_version
+
+    def set_command(
+        self, bot_id: int, message: str, match_type: MatchTypeEnum, response: str
+    ) -> None:
+        matcher = self.bots.get(bot_id)
+        if matcher is not None:
+            matcher.set_command(message, match_type, response)
+
+    def remove_command(self, bot_id: int, message: str) -> None:
+        matcher = self.bots.get(bot_id)
+        if matcher is not None:
+            matcher.remove_command(message)
+
+    def invalidate(self, bot_id: int) -> None:
+        self.bots.pop(bot_id, None)
+
+    def set_version(self, bot_id: int, version: int) -> None:
+        self.published.setdefault(bot_id, set()).add(version)
+        self.bump(bot_id, version)
+
+    def evict(self, bot_id: int, version: int) -> bool:
+        published = self.published.get(bot_id)
+        if published is not None and version in published:
+            published.discard(version)
+            if not published:
+                del self.published[bot_id]
+            return False
+        self.bump(bot_id, version)
+        self.bots.pop(bot_id, None)
+        return True
+
+    def bump(self, bot_id: int, version: int) -> None:
+        self.versions[bot_id] = version
+        self.generations[bot_id] = self.generations.get(bot_id, 0) + 1
+        self.commands_versions.pop(bot_id, None)
+
+    def clear(self) -> None:
+        self.bots.clear()
+        self.versions.clear()
+        self.generations.clear()
+        self.published.clear()
+        self.commands_versions.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+command_index = CommandIndex()
+REGISTRY.register(CommandIndexCollector(command_index))
+
+
+class BotListCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.pages: Dict[Tuple[Optional[str], int, int], bytes] = {}
+
+    def get(self, name: Optional[str], after: int, limit: int) -> Optional[bytes]:
+        return self.pages.get((name, after, limit))
+
+    def put(self, name: Optional[str], after: int, limit: int, page: bytes) -> None:
+        if len(self.pages) >= self.max_size:
+            self.pages.clear()
+        self.pages[(name, after, limit)] = page
+
+    def clear(self) -> None:
+        self.pages.clear()
+
+
+bot_list_cache = BotListCache(settings.bot_list_cache_size)
+
+
+class PrincipalCache:
+    def __init__(self, max_size: int, ttl: int) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: 'OrderedDict[str, Tuple[float, Dict[str, Any], Principal]]' = (
+            OrderedDict()
+        )
+        self.tokens_by_user: Dict[str, Set[str]] = {}
+        self.lock = Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time():
+                self._remove(token)
+                return None
+            self.entries.move_to_end(token)
+            return entry[2]
+
+    def put(self, token: str, claims: Dict[str, Any], principal: Principal) -> None:
+        expires_at = time() + self.ttl
+        if claims.get('exp') is not None:
+            expires_at = min(expires_at, claims['exp'])
+
+        with self.lock:
+            self.entries[token] = (expires_at, claims, principal)
+            self.entries.move_to_end(token)
+            self.tokens_by_user.setdefault(principal.username, set()).add(token)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def evict_user(self, username: str) -> None:
+        with self.lock:
+            for token in self.tokens_by_user.pop(username, set()):
+                self.entries.pop(token, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.tokens_by_user.clear()
+
+    def _remove(self, token: str) -> None:
+        _, _, principal = self.entries.pop(token)
+        tokens = self.tokens_by_user.get(principal.username)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_user[principal.username]
+
+
+principal_cache = PrincipalCache(
+    settings.principal_cache_size, settings.principal_cache_ttl
+)
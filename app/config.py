@@ -1,15 +1,73 @@
+from typing import Literal, Optional
+
 from pydantic import BaseSettings
 
 ALGORITHM = 'HS256'
+MSGPACK_SUBPROTOCOL = 'chat.msgpack'
+MAX_BATCH_SIZE = 100
 HISTORY_SIZE = 10
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+BOTS_PAGE_SIZE = 100
+MAX_BOTS_PAGE_SIZE = 500
+COMMANDS_PAGE_SIZE = 100
+MAX_COMMANDS_PAGE_SIZE = 1000
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
 
 
 class EnvSettings(BaseSettings):
     redis_url: str
-    sqlite_url: str
+    sqlite_url: str = 'sqlite:///application.db'
+    database_url: Optional[str] = None
     secret_key: str
     server_url: str
     access_token_expire_minutes: int
+    async_db: bool = True
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout: int = 30000
+    sqlite_journal_mode: str = 'WAL'
+    sqlite_synchronous: str = 'NORMAL'
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    sqlite_busy_timeout: int = 5000
+    history_size: int = HISTORY_SIZE
+    message_retention_days: Optional[int] = None
+    message_prune_interval: int = 3600
+    principal_cache_size: int = 1024
+    principal_cache_ttl: int = 60
+    bot_list_cache_size: int = 256
+    password_hash_workers: int = 2
+    password_hash_queue_size: int = 32
+    trace_sample_rate: float = 0.0
+    trace_header: Optional[str] = None
+    trace_slow_ms: float = 250.0
+    trace_log_path: str = 'slow_traces.jsonl'
+    trace_profile: bool = False
+    node_id: Optional[str] = None
+    presence_ttl: int = 30
+    presence_heartbeat: int = 10
+    redis_pool_size: int = 10
+    reply_queue: bool = False
+    reply_workers: int = 0
+    reply_stream: str = 'replies'
+    reply_group: str = 'reply-workers'
+    reply_stream_max_len: int = 100_000
+    reply_batch_size: int = 10
+    reply_block_ms: int = 1000
+    reply_claim_idle_ms: int = 60_000
+    reply_claim_interval: float = 30.0
+    reply_max_deliveries: int = 5
+    ws_send_queue_size: int = 100
+    ws_overflow_policy: Literal['drop_oldest', 'coalesce', 'disconnect'] = 'drop_oldest'
+    ws_send_timeout: float = 5.0
+
+    @property
+    def db_url(self) -> str:
+        return self.database_url or self.sqlite_url
 
     class Config:
         case_sensitive = False
@@ -1,23 +1,188 @@
-from typing import List
+import asyncio
+import logging
+from collections import deque
+from functools import partial
+from typing import Callable, Deque, Dict, Optional, Tuple
 
-from fastapi import WebSocket
+from fastapi import WebSocket, status
+from prometheus_client import REGISTRY
+
+from app.config import MSGPACK_SUBPROTOCOL, settings
+from app.framing import Frame, coalesce, render_text
+from app.metrics import MESSAGES_OUT, SEND_FAILURES, SLOW_CONSUMERS, WebSocketCollector
+
+logger = logging.getLogger(__name__)
+
+Room = Tuple[int, int]
+
+
+class Connection:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_abort: Callable[['Connection'], None],
+        binary: bool = False,
+    ) -> None:
+        self.websocket = websocket
+        self.on_abort = on_abort
+        self.binary = binary
+        self.queue: Deque[Frame] = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.closing: Optional['asyncio.Task[None]'] = None
+        self.send_started: Optional[float] = None
+        self.writer = asyncio.create_task(self.write())
+
+    def send(self, message: Frame) -> None:
+        if self.closed:
+            return
+
+        if len(self.queue) >= settings.ws_send_queue_size:
+            policy = settings.ws_overflow_policy
+            SLOW_CONSUMERS.labels(policy).inc()
+            if policy == 'disconnect':
+                self.abort()
+                return
+            if policy == 'coalesce':
+                message = coalesce((*self.queue, message))
+                self.queue.clear()
+            else:
+                self.queue.popleft()
+
+        self.queue.append(message)
+        self.ready.set()
+
+    async def write(self) -> None:
+        while True:
+            await self.ready.wait()
+            while self.queue:
+                if not await self.write_one(self.queue.popleft()):
+                    self.abort()
+                    return
+            self.ready.clear()
+
+    async def write_one(self, message: Frame) -> bool:
+        self.send_started = asyncio.get_running_loop().time()
+        try:
+            if isinstance(message, bytes):
+                await self.websocket.send_bytes(message)
+            else:
+                await self.websocket.send_text(message)
+        except Exception:  # pylint: disable=broad-except
+            SEND_FAILURES.inc()
+            logger.info('Dropping broken websocket', exc_info=True)
+            return False
+        self.send_started = None
+        return True
+
+    def timed_out(self, now: float) -> bool:
+        return (
+            self.send_started is not None
+            and now - self.send_started > settings.ws_send_timeout
+        )
+
+    def abort(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.on_abort(self)
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        self.closing = asyncio.create_task(self.close_socket())
+
+    async def close_socket(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        try:
+            await asyncio.wait_for(self.websocket.close(code), settings.ws_send_timeout)
+        except Exception:  # pylint: disable=broad-except
+            logger.debug('Websocket close failed', exc_info=True)
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE) -> None:
+        self.closed = True
+        self.queue.clear()
+        self.writer.cancel()
+        await self.close_socket(code)
 
 
 class ConnectionManager:
     def __init__(self) -> None:
-        self.active_connections: List[WebSocket] = []
+        self.rooms: Dict[Room, Dict[int, Connection]] = {}
+        self.watchdog: Optional['asyncio.Task[None]'] = None
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        bot_id: int,
+        subprotocol: Optional[str] = None,
+    ) -> None:
+        if subprotocol is None:
+            await websocket.accept()
+        else:
+            await websocket.accept(subprotocol=subprotocol)
+        room = (user_id, bot_id)
+        self.rooms.setdefault(room, {})[id(websocket)] = Connection(
+            websocket,
+            partial(self.on_abort, room),
+            binary=subprotocol == MSGPACK_SUBPROTOCOL,
+        )
+        if self.watchdog is None:
+            self.watchdog = asyncio.create_task(self.watch_sends())
+
+    async def watch_sends(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.rooms:
+            await asyncio.sleep(settings.ws_send_timeout / 2)
+            now = loop.time()
+            stuck = [
+                connection
+                for connections in tuple(self.rooms.values())
+                for connection in tuple(connections.values())
+                if connection.timed_out(now)
+            ]
+            for connection in stuck:
+                SEND_FAILURES.inc()
+                logger.info('Dropping websocket stuck in send')
+                connection.abort()
+        self.watchdog = None
+
+    def on_abort(self, room: Room, connection: Connection) -> None:
+        self.discard(room, connection)
 
-    async def connect(self, websocket: WebSocket) -> None:
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    def discard(self, room: Room, connection: Connection) -> Optional[Connection]:
+        connections = self.rooms.get(room)
+        if connections is None:
+            return None
+        removed = connections.pop(id(connection.websocket), None)
+        if not connections:
+            del self.rooms[room]
+        return removed
 
-    async def disconnect(self, websocket: WebSocket) -> None:
-        self.active_connections.remove(websocket)
-        await websocket.close()
+    async def disconnect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        bot_id: int,
+        code: int = status.WS_1000_NORMAL_CLOSURE,
+    ) -> None:
+        connection = self.rooms.get((user_id, bot_id), {}).get(id(websocket))
+        if connection is None:
+            return
+        self.discard((user_id, bot_id), connection)
+        await connection.close(code)
 
-    async def broadcast(self, message: str) -> None:
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def broadcast(self, user_id: int, bot_id: int, record: bytes) -> None:
+        connections = tuple(self.rooms.get((user_id, bot_id), {}).values())
+        text: Optional[str] = None
+        for connection in connections:
+            if connection.binary:
+                connection.send(record)
+                continue
+            if text is None:
+                text = render_text(record)
+            connection.send(text)
+        MESSAGES_OUT.inc(len(connections))
 
 
 manager = ConnectionManager()
+REGISTRY.register(WebSocketCollector(manager.rooms))
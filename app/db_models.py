@@ -1,10 +1,9 @@
 from enum import Enum
 
-from sqlalchemy import Column
+from sqlalchemy import BigInteger, Column
 from sqlalchemy import Enum as AlchEnum
-from sqlalchemy import ForeignKey, Integer, String
-from sqlalchemy.ext.declarative import DeclarativeMeta, declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy import Float, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import DeclarativeMeta, declarative_base, relationship
 
 Base: DeclarativeMeta = declarative_base()
 
@@ -14,6 +13,14 @@ class RoleEnum(str, Enum):
     USER = 'user'
 
 
+class MatchTypeEnum(str, Enum):
+    EXACT = 'exact'
+    IGNORE_CASE = 'ignore_case'
+    PREFIX = 'prefix'
+    KEYWORD = 'keyword'
+    REGEX = 'regex'
+
+
 class User(Base):
     __tablename__ = 'User'
 
@@ -30,17 +37,41 @@ class Bot(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     author_id = Column(Integer, ForeignKey('User.id'), nullable=False)
+    history_size = Column(Integer)
+    message_retention_days = Column(Integer)
+    commands_version = Column(Integer, nullable=False, default=0, server_default='0')
 
     author = relationship('User')
-    commands = relationship('Command')
+    commands = relationship('Command', back_populates='bot')
 
 
 class Command(Base):
     __tablename__ = 'Command'
+    __table_args__ = (
+        Index('ux_command_bot_message', 'bot_id', 'message', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
-    message = Column(String, unique=True, nullable=False)
+    message = Column(String, nullable=False)
     response = Column(String, nullable=False)
+    match_type = Column(
+        AlchEnum(MatchTypeEnum),
+        nullable=False,
+        default=MatchTypeEnum.EXACT,
+        server_default=MatchTypeEnum.EXACT.name,
+    )
     bot_id = Column(Integer, ForeignKey('Bot.id'), nullable=False)
 
-    bot = relationship('Bot')
+    bot = relationship('Bot', back_populates='commands')
+
+
+class Message(Base):
+    __tablename__ = 'Message'
+    __table_args__ = (Index('ix_message_room', 'user_id', 'bot_id', 'id'),)
+
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey('User.id'), nullable=False)
+    bot_id = Column(Integer, ForeignKey('Bot.id'), nullable=False)
+    ts = Column(Float, nullable=False)
+    sender = Column(String, nullable=False)
+    body = Column(String, nullable=False)
@@ -1,22 +1,186 @@
-from contextlib import contextmanager
-from typing import Any, Iterator, Optional
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import copy_context
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Union
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, func, select, text
+from sqlalchemy.engine import URL, Engine, Row, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy.sql import Select
 
 from app.app_utils import get_password_hash
 from app.config import settings
-from app.db_models import Bot, Command, RoleEnum, User
+from app.db_models import Base, Bot, Command, Message, RoleEnum, User
+from app.metrics import (
+    DB_EXECUTOR_PENDING,
+    after_cursor_execute,
+    before_cursor_execute,
+)
+from app.migrations import migrate_db
+from app.tracing import span
 
-engine = create_engine(settings.sqlite_url, connect_args={'check_same_thread': False})
+
+def set_sqlite_pragmas(dbapi_connection: Any, _: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA journal_mode={settings.sqlite_journal_mode}')
+    cursor.execute(f'PRAGMA synchronous={settings.sqlite_synchronous}')
+    cursor.execute(f'PRAGMA mmap_size={settings.sqlite_mmap_size}')
+    cursor.execute(f'PRAGMA busy_timeout={settings.sqlite_busy_timeout}')
+    cursor.close()
+
+
+def tune_sqlite_engine(sqlite_engine: Engine) -> Engine:
+    event.listen(sqlite_engine, 'connect', set_sqlite_pragmas)
+    return sqlite_engine
+
+
+event.listen(Engine, 'before_cursor_execute', before_cursor_execute, named=True)
+event.listen(Engine, 'after_cursor_execute', after_cursor_execute, named=True)
+
+SYNC_DRIVERS = {'sqlite': 'pysqlite', 'postgresql': 'psycopg2'}
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+pool_options: Dict[str, Any] = {
+    'pool_size': settings.db_pool_size,
+    'max_overflow': settings.db_max_overflow,
+    'pool_timeout': settings.db_pool_timeout,
+}
+
+
+def with_driver(url: str, drivers: Dict[str, str]) -> URL:
+    database_url = make_url(url)
+    backend = database_url.get_backend_name()
+    return database_url.set(drivername=f'{backend}+{drivers[backend]}')
+
+
+def engine_options(database_url: URL, is_async: bool) -> Dict[str, Any]:
+    if database_url.get_backend_name() == 'sqlite':
+        return {'connect_args': {'check_same_thread': False}}
+
+    timeout = settings.db_statement_timeout
+    connect_args: Dict[str, Any]
+    if is_async:
+        connect_args = {'server_settings': {'statement_timeout': str(timeout)}}
+    else:
+        connect_args = {'options': f'-c statement_timeout={timeout}'}
+    return {
+        'connect_args': connect_args,
+        'pool_pre_ping': settings.db_pool_pre_ping,
+        'pool_recycle': settings.db_pool_recycle,
+    }
+
+
+def make_engine(url: str, pooled: bool = True) -> Engine:
+    database_url = with_driver(url, SYNC_DRIVERS)
+    options = engine_options(database_url, is_async=False)
+    if pooled:
+        options.update(poolclass=QueuePool, **pool_options)
+    else:
+        options.update(poolclass=NullPool)
+
+    new_engine = create_engine(database_url, **options)
+    if database_url.get_backend_name() == 'sqlite':
+        tune_sqlite_engine(new_engine)
+    return new_engine
+
+
+def make_async_engine(url: str, pooled: bool = True) -> AsyncEngine:
+    database_url = with_driver(url, ASYNC_DRIVERS)
+    options = engine_options(database_url, is_async=True)
+    if pooled:
+        options.update(poolclass=AsyncAdaptedQueuePool, **pool_options)
+    else:
+        options.update(poolclass=NullPool)
+
+    new_engine = create_async_engine(database_url, **options)
+    if database_url.get_backend_name() == 'sqlite':
+        tune_sqlite_engine(new_engine.sync_engine)
+    return new_engine
+
+
+engine = make_engine(settings.db_url)
 SessionLocal = sessionmaker(bind=engine)
 
+async_engine = make_async_engine(settings.db_url)
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+
+class ThreadedSession:
+    def __init__(self, session: Session) -> None:
+        self.sync_session = session
+
+    async def run_sync(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with span('db.run_sync'), DB_EXECUTOR_PENDING.track_inprogress():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, copy_context().run, fn, self.sync_session, *args
+            )
+
+    async def commit(self) -> None:
+        await self.run_sync(Session.commit)
+
+    async def rollback(self) -> None:
+        await self.run_sync(Session.rollback)
+
+    async def close(self) -> None:
+        await self.run_sync(Session.close)
+
+
+DbSession = Union[AsyncSession, ThreadedSession]
+
 
 def get_user(session: Session, username: str) -> Optional[User]:
     user = session.query(User).filter_by(username=username).one_or_none()
     return user
 
 
+def add_user(session: Session, user: User) -> None:
+    session.add(user)
+    session.commit()
+
+
+def save_messages(
+    session: Session, user_id: int, bot_id: int, records: List[Dict[str, Any]]
+) -> None:
+    session.bulk_insert_mappings(
+        Message, [dict(record, user_id=user_id, bot_id=bot_id) for record in records]
+    )
+    session.commit()
+
+
+def get_messages_before(
+    session: Session, user_id: int, bot_id: int, before: Optional[int], limit: int
+) -> List[Dict[str, Any]]:
+    query = session.query(Message.id, Message.ts, Message.sender, Message.body).filter(
+        Message.user_id == user_id, Message.bot_id == bot_id
+    )
+    if before is not None:
+        query = query.filter(Message.id < before)
+
+    rows = query.order_by(Message.id.desc()).limit(limit).all()
+    return [row._asdict() for row in reversed(rows)]
+
+
+def prune_messages(session: Session, now: float) -> int:
+    retention_days = (
+        select(
+            func.coalesce(Bot.message_retention_days, settings.message_retention_days)
+        )
+        .where(Bot.id == Message.bot_id)
+        .scalar_subquery()
+    )
+    deleted = (
+        session.query(Message)
+        .filter(Message.ts < now - retention_days * 86400)
+        .delete(synchronize_session=False)
+    )
+    session.commit()
+    return deleted
+
+
 def insert_initial_data(session: Session) -> None:
     if session.query(User).count() == 0:
         session.bulk_save_objects(
@@ -32,12 +196,29 @@ def insert_initial_data(session: Session) -> None:
                 Command(id=0, message='Hey', response='Hi From Bot', bot_id=0),
             ]
         )
+        reset_sequences(session)
+
+
+def reset_sequences(session: Session) -> None:
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table in Base.metadata.sorted_tables:
+        if 'id' not in table.c or table.c.id.autoincrement is False:
+            continue
+        session.execute(
+            text(
+                f'SELECT setval(pg_get_serial_sequence(\'"{table.name}"\', \'id\'), '
+                f'coalesce(max(id), 0) + 1, false) FROM "{table.name}"'
+            )
+        )
 
 
 def init_db() -> None:
     import app.db_models as models  # pylint: disable=import-outside-toplevel
 
     models.Base.metadata.create_all(engine)
+    migrate_db(engine)
 
     with create_session() as session:
         insert_initial_data(session)
@@ -62,6 +243,46 @@ def create_session(**kwargs: Any) -> Iterator[Any]:
         new_session.close()
 
 
-def get_session() -> Any:
-    with create_session() as session:
+def new_db_session() -> DbSession:
+    if settings.async_db:
+        return AsyncSessionLocal()
+    return ThreadedSession(SessionLocal())
+
+
+@asynccontextmanager
+async def create_db_session(
+    factory: Callable[[], DbSession] = new_db_session
+) -> AsyncIterator[DbSession]:
+    new_session = factory()
+    try:
+        yield new_session
+        await new_session.commit()
+    except Exception:
+        await new_session.rollback()
+        raise
+    finally:
+        await new_session.close()
+
+
+async def get_session() -> AsyncIterator[DbSession]:
+    async with create_db_session() as session:
         yield session
+
+
+async def stream_partitions(
+    session: DbSession, statement: Select, size: int
+) -> AsyncIterator[List[Row]]:
+    statement = statement.execution_options(yield_per=size)
+    if isinstance(session, AsyncSession):
+        async_result = await session.stream(statement)
+        async for partition in async_result.partitions(size):
+            yield partition
+        return
+
+    result = await session.run_sync(lambda s: s.execute(statement))
+    partitions = result.partitions(size)
+    while True:
+        partition = await session.run_sync(lambda _: next(partitions, None))
+        if partition is None:
+            return
+        yield partition
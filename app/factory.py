@@ -1,15 +1,36 @@
 from fastapi import FastAPI
 
+from app.app_utils import password_hasher
+from app.config import settings
+from app.connection_manager import manager
+from app.db_utils import async_engine, engine
+from app.migrations import migrate_history
+from app.presence import presence_dao
 from app.redis_utils import redis_dao
-from app.routers import bots, chat, users
+from app.replies import reply_workers
+from app.retention import message_pruner
+from app.routers import bots, chat, metrics, users
+from app.tracing import TracingMiddleware
 
 
 async def on_startup() -> None:
     await redis_dao.init_conn()
+    await redis_dao.claim_worker_id()
+    await migrate_history(redis_dao.redis)
+    await redis_dao.subscribe_invalidations(manager)
+    presence_dao.start_heartbeat(manager)
+    await reply_workers.start(settings.reply_workers)
+    message_pruner.start(settings.message_prune_interval)
 
 
 async def on_shutdown() -> None:
+    await message_pruner.stop()
+    await reply_workers.stop()
+    await presence_dao.clear_presence()
     await redis_dao.close_redis_connection()
+    password_hasher.shutdown()
+    await async_engine.dispose()
+    engine.dispose()
 
 
 def create_app() -> FastAPI:
@@ -18,6 +39,9 @@ def create_app() -> FastAPI:
     app.include_router(bots.router)
     app.include_router(users.router)
     app.include_router(chat.router)
+    app.include_router(metrics.router)
+
+    app.add_middleware(TracingMiddleware)
 
     app.add_event_handler('startup', on_startup)
     app.add_event_handler('shutdown', on_shutdown)
@@ -0,0 +1,132 @@
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import msgpack
+from fastapi import WebSocket, status
+
+from app.config import MAX_BATCH_SIZE
+from app.matching import CommandMatcher
+
+Record = Dict[str, Any]
+Frame = Union[str, bytes]
+
+LEGACY_ID = 0
+
+
+class FrameError(Exception):
+    def __init__(self, code: int) -> None:
+        super().__init__(code)
+        self.code = code
+
+
+def pack(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def unpack(raw: bytes) -> Any:
+    return msgpack.unpackb(raw, raw=False)
+
+
+def unpack_record(raw: bytes) -> Record:
+    try:
+        value = json.loads(raw) if raw[:1] == b'{' else unpack(raw)
+    except ValueError:
+        value = None
+    if isinstance(value, (dict, list)):
+        return value  # type: ignore
+
+    sender, _, body = raw.decode(errors='replace').partition(': ')
+    return {'id': LEGACY_ID, 'ts': 0.0, 'sender': sender, 'body': body}
+
+
+def format_record(record: Record) -> str:
+    return f'{record["sender"]}: {record["body"]}'
+
+
+def render_text(raw: bytes) -> str:
+    value = unpack_record(raw)
+    if isinstance(value, list):
+        return json.dumps(
+            [format_record(record) for record in value], ensure_ascii=False
+        )
+    return format_record(value)
+
+
+def pack_array(packed: Sequence[bytes]) -> bytes:
+    size = len(packed)
+    if size < 16:
+        header = bytes((0x90 | size,))
+    elif size < 0x10000:
+        header = b'\xdc' + size.to_bytes(2, 'big')
+    else:
+        header = b'\xdd' + size.to_bytes(4, 'big')
+    return header + b''.join(packed)
+
+
+def text_batch(frame: str) -> Optional[List[str]]:
+    if not frame.startswith('['):
+        return None
+    try:
+        value = json.loads(frame)
+    except ValueError:
+        return None
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    return None
+
+
+def parse_text(frame: str) -> List[str]:
+    batch = text_batch(frame)
+    if batch is None:
+        return [frame]
+    if len(batch) > MAX_BATCH_SIZE:
+        raise ValueError(f'Batch of {len(batch)} messages exceeds {MAX_BATCH_SIZE}')
+    return batch
+
+
+def parse_binary(frame: bytes) -> List[str]:
+    value = msgpack.unpackb(frame, raw=False, max_array_len=MAX_BATCH_SIZE)
+    if not isinstance(value, list):
+        value = [value]
+    return [item for item in value if isinstance(item, str)]
+
+
+async def receive_batch(websocket: WebSocket, binary: bool) -> List[str]:
+    try:
+        if binary:
+            return parse_binary(await websocket.receive_bytes())
+        return parse_text(await websocket.receive_text())
+    except (KeyError, TypeError) as e:
+        raise FrameError(status.WS_1003_UNSUPPORTED_DATA) from e
+    except ValueError as e:
+        raise FrameError(status.WS_1007_INVALID_FRAME_PAYLOAD_DATA) from e
+
+
+def unpack_batch(
+    batch: Sequence[str],
+    sender: str,
+    bot_name: str,
+    matcher: Optional[CommandMatcher] = None,
+) -> List[Tuple[str, str]]:
+    messages: List[Tuple[str, str]] = []
+    for message in batch:
+        messages.append((sender, message))
+        response = None if matcher is None else matcher.match(message)
+        if response is not None:
+            messages.append((bot_name, response))
+    return messages
+
+
+def coalesce(frames: Sequence[Frame]) -> Frame:
+    if isinstance(frames[0], str):
+        lines: List[str] = []
+        for frame in frames:
+            batch = text_batch(frame)  # type: ignore
+            lines.extend([frame] if batch is None else batch)  # type: ignore
+        return json.dumps(lines, ensure_ascii=False)
+
+    records: List[Record] = []
+    for frame in frames:
+        value = unpack(frame)  # type: ignore
+        records.extend(value if isinstance(value, list) else [value])
+    return pack(records)
@@ -0,0 +1,271 @@
+import logging
+import re
+from collections import deque
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+)
+
+from app.db_models import MatchTypeEnum
+
+try:
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # pragma: no cover
+    import sre_parse  # pylint: disable=deprecated-module
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+RE_CASE_FOLD = str.maketrans({'İ': 'i', 'ı': 'i', 'ſ': 's', 'K': 'k'})
+
+
+def is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+def is_word_boundary(text: str, index: int) -> bool:
+    before = index > 0 and is_word_char(text[index - 1])
+    after = index < len(text) and is_word_char(text[index])
+    return before != after
+
+
+def fold_for_regex(text: str) -> str:
+    return text.translate(RE_CASE_FOLD).lower()
+
+
+LITERAL = getattr(sre_parse, 'LITERAL', None)
+SUBPATTERN = getattr(sre_parse, 'SUBPATTERN', None)
+
+
+def literal_runs(pattern: Pattern[str]) -> List[str]:
+    ignore_case = bool(pattern.flags & re.IGNORECASE)
+    runs: List[str] = []
+    run: List[str] = []
+
+    def walk(items: Iterable[Tuple[Any, Any]]) -> None:
+        for op, arg in items:
+            if op == LITERAL:
+                char = chr(arg)
+                if not ignore_case or char.isascii():
+                    run.append(char)
+                    continue
+            elif op == SUBPATTERN:
+                group, add_flags, del_flags, sub_items = arg
+                if group is None and not add_flags and not del_flags:
+                    walk(sub_items)
+                    continue
+            runs.append(''.join(run))
+            run.clear()
+
+    walk(sre_parse.parse(pattern.pattern, pattern.flags))
+    runs.append(''.join(run))
+    return runs
+
+
+def required_literal(pattern: Pattern[str]) -> str:
+    if LITERAL is None or SUBPATTERN is None:
+        return ''
+    try:
+        runs = literal_runs(pattern)
+    except Exception:  # pylint: disable=broad-except
+        logger.debug('Cannot prefilter regex %r', pattern.pattern, exc_info=True)
+        return ''
+    literal = max(runs, key=len)
+    return literal.lower() if pattern.flags & re.IGNORECASE else literal
+
+
+class Automaton:
+    def __init__(self) -> None:
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, int]]] = [[]]
+
+    def __bool__(self) -> bool:
+        return len(self.goto) > 1
+
+    def add(self, word: str, value: int) -> None:
+        state = 0
+        for char in word:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((len(word), value))
+
+    def build(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = 0 if target == child else target
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def search(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in output[state]:
+                yield end - length, end, value
+
+
+class RegexIndex:
+    def __init__(self) -> None:
+        self.patterns: List[Tuple[Pattern[str], str]] = []
+        self.literals = Automaton()
+        self.folded_literals = Automaton()
+        self.unfiltered: List[int] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def add(self, message: str, response: str) -> None:
+        try:
+            pattern = re.compile(message)
+        except re.error:
+            logger.warning('Skipping invalid regex command %r', message)
+            return
+
+        index = len(self.patterns)
+        self.patterns.append((pattern, response))
+        literal = required_literal(pattern)
+        if not literal:
+            self.unfiltered.append(index)
+        elif pattern.flags & re.IGNORECASE:
+            self.folded_literals.add(literal, index)
+        else:
+            self.literals.add(literal, index)
+
+    def build(self) -> None:
+        self.literals.build()
+        self.folded_literals.build()
+
+    def match(self, message: str) -> Optional[str]:
+        candidates: Set[int] = set(self.unfiltered)
+        if self.literals:
+            candidates.update(index for _, _, index in self.literals.search(message))
+        if self.folded_literals:
+            folded = fold_for_regex(message)
+            candidates.update(
+                index for _, _, index in self.folded_literals.search(folded)
+            )
+
+        best: Optional[Tuple[int, int]] = None
+        for index in candidates:
+            found = self.patterns[index][0].search(message)
+            if found is not None and (best is None or (found.start(), index) < best):
+                best = (found.start(), index)
+        return None if best is None else self.patterns[best[1]][1]
+
+
+class CommandMatcher:
+    def __init__(self, commands: Iterable[Tuple[str, MatchTypeEnum, str]] = ()) -> None:
+        self.commands: Dict[str, Tuple[MatchTypeEnum, str]] = {
+            message: (match_type, response)
+            for message, match_type, response in commands
+        }
+        self.compiled = False
+        self.exact: Dict[str, str] = {}
+        self.folded: Dict[str, str] = {}
+        self.prefixes: Dict[str, str] = {}
+        self.prefix_lengths: List[int] = []
+        self.keywords: Dict[str, str] = {}
+        self.phrases = Automaton()
+        self.phrase_responses: List[str] = []
+        self.regexes = RegexIndex()
+
+    def set_command(
+        self, message: str, match_type: MatchTypeEnum, response: str
+    ) -> None:
+        self.commands[message] = (match_type, response)
+        self.compiled = False
+
+    def remove_command(self, message: str) -> None:
+        if self.commands.pop(message, None) is not None:
+            self.compiled = False
+
+    def compile(self) -> None:
+        self.exact, self.folded, self.prefixes, self.keywords = {}, {}, {}, {}
+        self.phrases, self.phrase_responses = Automaton(), []
+        self.regexes = RegexIndex()
+
+        for message, (match_type, response) in self.commands.items():
+            if match_type == MatchTypeEnum.EXACT:
+                self.exact[message] = response
+            elif match_type == MatchTypeEnum.IGNORE_CASE:
+                self.folded.setdefault(message.casefold(), response)
+            elif match_type == MatchTypeEnum.PREFIX:
+                self.prefixes.setdefault(message.casefold(), response)
+            elif match_type == MatchTypeEnum.KEYWORD:
+                if WORD_RE.fullmatch(message):
+                    self.keywords.setdefault(message.casefold(), response)
+                elif message:
+                    self.phrases.add(message.casefold(), len(self.phrase_responses))
+                    self.phrase_responses.append(response)
+            else:
+                self.regexes.add(message, response)
+
+        self.prefix_lengths = sorted(
+            {len(prefix) for prefix in self.prefixes}, reverse=True
+        )
+        self.phrases.build()
+        self.regexes.build()
+        self.compiled = True
+
+    def match_phrase(self, folded: str) -> Optional[str]:
+        best: Optional[Tuple[int, int]] = None
+        for start, end, index in self.phrases.search(folded):
+            if (
+                (best is None or (start, index) < best)
+                and is_word_boundary(folded, start)
+                and is_word_boundary(folded, end)
+            ):
+                best = (start, index)
+        return None if best is None else self.phrase_responses[best[1]]
+
+    def match_folded(self, folded: str) -> Optional[str]:
+        response = self.folded.get(folded)
+        if response is not None:
+            return response
+
+        for length in self.prefix_lengths:
+            response = self.prefixes.get(folded[:length])
+            if response is not None:
+                return response
+
+        if self.keywords:
+            for word in WORD_RE.findall(folded):
+                response = self.keywords.get(word)
+                if response is not None:
+                    return response
+
+        return self.match_phrase(folded) if self.phrases else None
+
+    def match(self, message: str) -> Optional[str]:
+        if not self.compiled:
+            self.compile()
+
+        response = self.exact.get(message)
+        if response is None:
+            response = self.match_folded(message.casefold())
+        if response is None and self.regexes:
+            response = self.regexes.match(message)
+        return response
@@ -0,0 +1,158 @@
+from functools import wraps
+from time import perf_counter
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterator,
+    Mapping,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.tracing import record_span
+
+F = TypeVar('F', bound=Callable[..., Awaitable[Any]])
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by route',
+    ['method', 'route'],
+)
+MESSAGES = Counter(
+    'chat_messages_total',
+    'Chat messages received from and sent to websockets',
+    ['direction'],
+)
+MESSAGES_IN = MESSAGES.labels('in')
+MESSAGES_OUT = MESSAGES.labels('out')
+SLOW_CONSUMERS = Counter(
+    'websocket_send_overflows_total',
+    'Messages hitting a full websocket send queue, by overflow policy',
+    ['policy'],
+)
+SEND_FAILURES = Counter(
+    'websocket_send_failures_total', 'Websocket sends that failed or timed out'
+)
+REDIS_LATENCY = Histogram(
+    'redis_command_duration_seconds',
+    'Latency of RedisDao operations',
+    ['method'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+DB_QUERY_TIME = Histogram(
+    'db_query_duration_seconds',
+    'Time spent executing SQL statements',
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+PASSWORD_HASH_PENDING = Gauge(
+    'password_hash_pending', 'Password operations queued or running in the pool'
+)
+PASSWORD_HASH_WAIT = Histogram(
+    'password_hash_wait_seconds', 'Time password operations wait for a worker'
+)
+DB_EXECUTOR_PENDING = Gauge(
+    'db_executor_pending',
+    'Database calls queued or running in the default thread pool',
+)
+
+
+def observe_latency(
+    histogram: Histogram, span_name: Optional[str] = None
+) -> Callable[[F], F]:
+    def decorator(func: F) -> F:
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                finished = perf_counter()
+                histogram.observe(finished - started)
+                if span_name is not None:
+                    record_span(span_name, started, finished)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def redis_timed(method: str) -> Callable[[F], F]:
+    return observe_latency(REDIS_LATENCY.labels(method), f'redis.{method}')
+
+
+def before_cursor_execute(**kw: Any) -> None:
+    kw['context'].query_started = perf_counter()
+
+
+def after_cursor_execute(**kw: Any) -> None:
+    finished = perf_counter()
+    started = kw['context'].query_started
+    DB_QUERY_TIME.observe(finished - started)
+    record_span('db.query', started, finished)
+
+
+class WebSocketCollector:
+    def __init__(self, rooms: Mapping[Any, Mapping[int, Any]]) -> None:
+        self.rooms = rooms
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        counts: Dict[int, int] = {}
+        for (_, bot_id), connections in tuple(self.rooms.items()):
+            counts[bot_id] = counts.get(bot_id, 0) + len(connections)
+
+        gauge = GaugeMetricFamily(
+            'websocket_connections',
+            'Open websocket connections by bot',
+            labels=['bot_id'],
+        )
+        for bot_id, count in counts.items():
+            gauge.add_metric([str(bot_id)], count)
+        yield gauge
+
+
+class CommandIndexCollector:
+    def __init__(self, index: Any) -> None:
+        self.index = index
+
+    def collect(self) -> Iterator[Union[CounterMetricFamily, GaugeMetricFamily]]:
+        lookups = CounterMetricFamily(
+            'command_index_lookups',
+            'Command index lookups by result',
+            labels=['result'],
+        )
+        lookups.add_metric(['hit'], self.index.hits)
+        lookups.add_metric(['miss'], self.index.misses)
+        yield lookups
+        yield GaugeMetricFamily(
+            'command_index_bots',
+            'Bots with a compiled command matcher',
+            value=len(self.index.bots),
+        )
+
+
+class TimedRoute(APIRoute):
+    def get_route_handler(
+        self,
+    ) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+        histograms = {
+            method: REQUEST_LATENCY.labels(method, self.path) for method in self.methods
+        }
+
+        async def timed_handler(request: Request) -> Response:
+            started = perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                histograms[request.method].observe(perf_counter() - started)
+
+        return timed_handler
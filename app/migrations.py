@@ -0,0 +1,109 @@
+from typing import Any, Dict, List
+
+from aioredis import WatchVariableError
+from sqlalchemy import Column, Table, inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql.sqltypes import SchemaType
+
+from app.db_models import Base, Command
+from app.framing import LEGACY_ID, pack, unpack_record
+
+LEGACY_IDS = 'legacy:ids'
+HISTORY_MIGRATION = 'migrations:history'
+
+
+def add_column(connection: Connection, table: Table, column: Column) -> None:
+    if isinstance(column.type, SchemaType):
+        column.type.create(connection, checkfirst=True)
+    column_type = column.type.compile(dialect=connection.dialect)
+    ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+    if column.server_default is not None:
+        ddl += f" DEFAULT '{column.server_default.arg}'"
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    connection.exec_driver_sql(ddl)
+
+
+def rebuild_table(connection: Connection, table: Table) -> None:
+    old_name = f'{table.name}_old'
+    columns = ', '.join(f'"{column.name}"' for column in table.columns)
+    connection.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"')
+    table.create(connection)
+    connection.exec_driver_sql(
+        f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{old_name}"'
+    )
+    connection.exec_driver_sql(f'DROP TABLE "{old_name}"')
+
+
+def migrate_db(engine: Engine) -> None:
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    add_column(connection, table, column)
+
+        global_message_unique = [
+            constraint
+            for constraint in inspector.get_unique_constraints(Command.__tablename__)
+            if constraint['column_names'] == ['message']
+        ]
+        for constraint in global_message_unique:
+            if connection.dialect.name == 'sqlite':
+                rebuild_table(connection, Command.__table__)
+                break
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{Command.__tablename__}" '
+                f'DROP CONSTRAINT "{constraint["name"]}"'
+            )
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+async def number_legacy(
+    redis: Any, records: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    legacy = [record for record in records if record['id'] == LEGACY_ID]
+    if legacy:
+        last = await redis.incrby(LEGACY_IDS, len(legacy))
+        for record_id, record in enumerate(legacy, last - len(legacy) + 1):
+            record['id'] = record_id
+    return records
+
+
+async def migrate_history(redis: Any) -> int:
+    if await redis.get(HISTORY_MIGRATION):
+        return 0
+    migrated = 0
+    async for key in redis.iscan(match='hist:*'):
+        migrated += await migrate_history_key(redis, key)
+    await redis.set(HISTORY_MIGRATION, 1)
+    return migrated
+
+
+async def migrate_history_key(redis: Any, key: bytes) -> int:
+    with await redis as conn:
+        while True:
+            await conn.watch(key)
+            records = [
+                unpack_record(record) for record in await conn.lrange(key, 0, -1)
+            ]
+            legacy = sum(record['id'] == LEGACY_ID for record in records)
+            if not legacy:
+                await conn.unwatch()
+                return 0
+
+            await number_legacy(redis, records)
+            transaction = conn.multi_exec()
+            transaction.delete(key)
+            transaction.rpush(key, *[pack(record) for record in records])
+            results = await transaction.execute(return_exceptions=True)
+            if not isinstance(results[0], WatchVariableError):
+                return legacy
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from asyncio import Task, create_task
+from time import time
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.connection_manager import ConnectionManager
+from app.metrics import redis_timed
+from app.redis_utils import NODE_ID, RedisDao, redis_dao
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_NODES = 'presence:nodes'
+
+
+class PresenceDao:
+    def __init__(self, dao: RedisDao) -> None:
+        self.dao = dao
+        self.heartbeat_task: Optional[Task] = None  # type: ignore
+
+    @property
+    def redis(self) -> Any:
+        return self.dao.redis
+
+    @redis_timed('add_presence')
+    async def add_presence(self, user_id: int, bot_id: int) -> None:
+        key = f'presence:{NODE_ID}'
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, f'{user_id}:{bot_id}', 1)
+        pipe.expire(key, settings.presence_ttl)
+        pipe.zadd(PRESENCE_NODES, time(), NODE_ID)
+        await pipe.execute()
+
+    @redis_timed('remove_presence')
+    async def remove_presence(self, user_id: int, bot_id: int) -> None:
+        key = f'presence:{NODE_ID}'
+        field = f'{user_id}:{bot_id}'
+        if await self.redis.hincrby(key, field, -1) <= 0:
+            await self.redis.hdel(key, field)
+
+    @redis_timed('write_presence')
+    async def write_presence(self, manager: ConnectionManager) -> None:
+        key = f'presence:{NODE_ID}'
+        counts = {
+            f'{user_id}:{bot_id}': len(connections)
+            for (user_id, bot_id), connections in tuple(manager.rooms.items())
+            if connections
+        }
+        transaction = self.redis.multi_exec()
+        transaction.delete(key)
+        if counts:
+            transaction.hmset_dict(key, counts)
+            transaction.expire(key, settings.presence_ttl)
+        transaction.zadd(PRESENCE_NODES, time(), NODE_ID)
+        await transaction.execute()
+
+    async def clear_presence(self) -> None:
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        transaction = self.redis.multi_exec()
+        transaction.delete(f'presence:{NODE_ID}')
+        transaction.zrem(PRESENCE_NODES, NODE_ID)
+        await transaction.execute()
+
+    @redis_timed('get_sessions')
+    async def get_sessions(self) -> Dict[str, Dict[str, int]]:
+        await self.redis.zremrangebyscore(
+            PRESENCE_NODES, max=time() - settings.presence_ttl
+        )
+        nodes = await self.redis.zrange(PRESENCE_NODES, encoding='utf-8')
+        pipe = self.redis.pipeline()
+        for node in nodes:
+            pipe.hgetall(f'presence:{node}', encoding='utf-8')
+        rooms = await pipe.execute()
+        return {
+            node: {room: int(count) for room, count in node_rooms.items()}
+            for node, node_rooms in zip(nodes, rooms)
+        }
+
+    def start_heartbeat(self, manager: ConnectionManager) -> None:
+        if self.heartbeat_task is None:
+            self.heartbeat_task = create_task(self.heartbeat(manager))
+
+    async def heartbeat(self, manager: ConnectionManager) -> None:
+        while True:
+            try:
+                await self.write_presence(manager)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to refresh presence of %s', NODE_ID)
+            await asyncio.sleep(settings.presence_heartbeat)
+
+
+presence_dao = PresenceDao(redis_dao)
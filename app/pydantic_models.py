@@ -1,6 +1,9 @@
-from typing import Any, Dict, List
+import re
+from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, validator
+
+from app.db_models import MatchTypeEnum, RoleEnum
 
 
 class Token(BaseModel):
@@ -12,6 +15,16 @@ class TokenData(BaseModel):
     username: str
 
 
+class Principal(BaseModel):
+    id: int
+    username: str
+    role: RoleEnum
+    full_name: str
+
+    class Config:
+        allow_mutation = False
+
+
 class RegisterModel(BaseModel):
     username: str
     password: str
@@ -30,16 +43,31 @@ class BotResponse(BaseModel):
 
 class GetBotsResponse(BaseModel):
     bots: List[BotResponse]
+    next_cursor: Optional[int]
 
 
 class CommandModel(BaseModel):
     command: str
     response: str
+    match_type: MatchTypeEnum = MatchTypeEnum.EXACT
+
+    @validator('match_type')
+    def check_regex(
+        cls, match_type: MatchTypeEnum, values: Dict[str, Any]
+    ) -> MatchTypeEnum:
+        if match_type == MatchTypeEnum.REGEX and 'command' in values:
+            try:
+                re.compile(values['command'])
+            except re.error as e:
+                raise ValueError(f'Invalid regex: {e}') from e
+        return match_type
 
 
 class AddBotModel(BaseModel):
     name: str
     commands: List[CommandModel]
+    history_size: Optional[int] = Field(None, gt=0)
+    message_retention_days: Optional[int] = Field(None, gt=0)
 
 
 class AddBotResponse(BaseModel):
@@ -48,6 +76,11 @@ class AddBotResponse(BaseModel):
     author: str
 
 
+class ImportBotsResponse(BaseModel):
+    imported_bots: List[int]
+    imported_commands: int
+
+
 class EditBotCommandModel(BaseModel):
     new_response: str
 
@@ -60,6 +93,7 @@ class UserIdModel(BaseModel):
 class GetBotCommandsResponse(BaseModel):
     bot_name: str
     commands: List[Any]
+    next_cursor: Optional[int]
 
 
 class AddBotCommandResponse(BaseModel):
@@ -79,5 +113,27 @@ class DeleteBotCommandResponse(BaseModel):
     deleted_command_id: int
 
 
+class HistoryMessage(BaseModel):
+    id: int
+    ts: float
+    sender: str
+    body: str
+
+
 class GetHistoryResponse(BaseModel):
-    history: List[str]
+    history: List[HistoryMessage]
+    next_cursor: Optional[int]
+
+
+class ReplyJob(BaseModel):
+    user_id: int
+    bot_id: int
+    bot_name: str
+    history_size: int
+    messages: List[str]
+
+
+class SessionsResponse(BaseModel):
+    total: int
+    bots: Dict[int, int]
+    nodes: Dict[str, int]
@@ -1,49 +1,172 @@
-from asyncio import create_task
+import logging
+import os
+import socket
+from asyncio import Task, create_task
 from threading import Lock
-from typing import Any, List
+from time import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from aioredis import create_redis_pool
+from aioredis.pubsub import Receiver
 
-from app.config import HISTORY_SIZE, settings
+from app.cache import bot_list_cache, command_index
+from app.config import settings
 from app.connection_manager import ConnectionManager
+from app.framing import pack, pack_array, unpack_record
+from app.metrics import redis_timed
+from app.migrations import number_legacy
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'bots:invalidate'
+ID_WORKERS = 'id:workers'
+NODE_ID = settings.node_id or f'{socket.gethostname()}:{os.getpid()}'
 
 
 class RedisDao:
     def __init__(self) -> None:
         self.redis: Any = None
+        self.receiver: Optional[Receiver] = None
+        self.reader_task: Optional[Task] = None  # type: ignore
+        self.subscriptions: Dict[str, int] = {}
 
     async def init_conn(self) -> None:
         if self.redis is None:
-            self.redis = await create_redis_pool(settings.redis_url)
+            self.redis = await create_redis_pool(
+                settings.redis_url,
+                maxsize=settings.redis_pool_size + settings.reply_workers,
+            )
 
-    async def get_history_from_redis(self, user_id: int, bot_id: int) -> List[str]:
+    @redis_timed('claim_worker_id')
+    async def claim_worker_id(self) -> int:
+        IdGenerator.worker_id = await self.redis.incr(ID_WORKERS) & 0x3FF
+        return IdGenerator.worker_id
+
+    @redis_timed('get_history_from_redis')
+    async def get_history_from_redis(
+        self, user_id: int, bot_id: int
+    ) -> List[Dict[str, Any]]:
         history_key = f'hist:{user_id}:{bot_id}'
-        await self.redis.ltrim(history_key, -HISTORY_SIZE, -1)
         history = await self.redis.lrange(history_key, 0, -1)
-        return history if history is not None else []
+        return [unpack_record(record) for record in history or []]
 
+    @redis_timed('publish_to_redis')
     async def publish_to_redis(
-        self, user_id: int, bot_id: int, login: str, message: str
-    ) -> None:
+        self,
+        user_id: int,
+        bot_id: int,
+        messages: Sequence[Tuple[str, str]],
+        history_size: Optional[int] = None,
+        batched: bool = False,
+    ) -> List[Dict[str, Any]]:
+        history_size = history_size or settings.history_size
         history_key = f'hist:{user_id}:{bot_id}'
         channel = f'ch:{user_id}:{bot_id}'
-        text = f'{login}: {message}'
-        await self.redis.rpush(history_key, text)
-        await self.redis.publish(channel, text)
+        ts = time()
+        records = [
+            pack(
+                {
+                    'id': IdGenerator.generate_id(),
+                    'ts': ts,
+                    'sender': login,
+                    'body': message,
+                }
+            )
+            for login, message in messages
+        ]
 
-    async def create_reader_task(
+        transaction = self.redis.multi_exec()
+        transaction.rpush(history_key, *records)
+        evicted = transaction.lrange(history_key, 0, -history_size - 1)
+        transaction.ltrim(history_key, -history_size, -1)
+        if batched:
+            transaction.publish(channel, pack_array(records))
+        else:
+            for record in records:
+                transaction.publish(channel, record)
+        await transaction.execute()
+
+        return await number_legacy(
+            self.redis, [unpack_record(record) for record in await evicted]
+        )
+
+    @redis_timed('subscribe')
+    async def subscribe(
         self, manager: ConnectionManager, user_id: int, bot_id: int
     ) -> None:
-        async def reader(ch: Any) -> None:
-            while await ch.wait_message():
-                msg = (await ch.get()).decode()
-                await manager.broadcast(msg)
+        channel = f'ch:{user_id}:{bot_id}'
+        count = self.subscriptions.get(channel, 0)
+        self.subscriptions[channel] = count + 1
+        if count == 0:
+            receiver = self._start_reader(manager)
+            await self.redis.subscribe(receiver.channel(channel))
 
+    @redis_timed('unsubscribe')
+    async def unsubscribe(self, user_id: int, bot_id: int) -> None:
         channel = f'ch:{user_id}:{bot_id}'
-        channels = await self.redis.subscribe(channel)
-        create_task(reader(channels[0]))
+        count = self.subscriptions.get(channel, 0) - 1
+        if count > 0:
+            self.subscriptions[channel] = count
+            return
+
+        self.subscriptions.pop(channel, None)
+        await self.redis.unsubscribe(channel)
+
+    async def subscribe_invalidations(self, manager: ConnectionManager) -> None:
+        receiver = self._start_reader(manager)
+        if INVALIDATION_CHANNEL.encode() not in receiver.channels:
+            await self.redis.subscribe(receiver.channel(INVALIDATION_CHANNEL))
+
+    @redis_timed('publish_invalidation')
+    async def publish_invalidation(self, bot_id: int) -> int:
+        version = await self.redis.incr(f'bot-version:{bot_id}')
+        command_index.set_version(bot_id, version)
+        await self.redis.publish(INVALIDATION_CHANNEL, f'{bot_id}:{version}')
+        return version
+
+    @redis_timed('publish_invalidations')
+    async def publish_invalidations(self, bot_ids: Sequence[int]) -> None:
+        pipe = self.redis.pipeline()
+        for bot_id in bot_ids:
+            pipe.incr(f'bot-version:{bot_id}')
+        versions = await pipe.execute()
+
+        pipe = self.redis.pipeline()
+        for bot_id, version in zip(bot_ids, versions):
+            command_index.set_version(bot_id, version)
+            pipe.publish(INVALIDATION_CHANNEL, f'{bot_id}:{version}')
+        await pipe.execute()
+
+    def _start_reader(self, manager: ConnectionManager) -> Receiver:
+        if self.receiver is None:
+            self.receiver = Receiver(on_close=lambda *args, **kwargs: None)
+            self.reader_task = create_task(self._reader(self.receiver, manager))
+        return self.receiver
+
+    async def _reader(self, receiver: Receiver, manager: ConnectionManager) -> None:
+        async for channel, msg in receiver.iter():
+            name = channel.name.decode()
+            if name == INVALIDATION_CHANNEL:
+                bot_id, version = msg.decode().split(':')
+                if command_index.evict(int(bot_id), int(version)):
+                    bot_list_cache.clear()
+                continue
+
+            _, user_id, bot_id = name.split(':')
+            try:
+                await manager.broadcast(int(user_id), int(bot_id), msg)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to deliver message to %s', name)
 
     async def close_redis_connection(self) -> None:
+        if self.receiver is not None:
+            self.receiver.stop()
+            self.receiver = None
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        self.subscriptions.clear()
+
         self.redis.close()
         await self.redis.wait_closed()
 
@@ -52,11 +175,14 @@ redis_dao = RedisDao()
 
 
 class IdGenerator:
-    cur_id: int = 0
+    epoch_ms: int = 1609459200000
+    worker_id: int = os.getpid() & 0x3FF
+    last_id: int = 0
     lock: Lock = Lock()
 
     @classmethod
-    def generate_id(cls) -> str:
+    def generate_id(cls) -> int:
         with cls.lock:
-            cls.cur_id += 1
-            return str(cls.cur_id)
+            ms = int(time() * 1000) - cls.epoch_ms
+            cls.last_id = max((ms << 22) | (cls.worker_id << 12), cls.last_id + 1)
+            return cls.last_id
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional, Sequence
+
+from app.cache import command_index
+from app.config import settings
+from app.connection_manager import manager
+from app.db_utils import (
+    DbSession,
+    create_db_session,
+    new_db_session,
+    save_messages,
+)
+from app.matching import CommandMatcher
+from app.pydantic_models import ReplyJob
+from app.redis_utils import NODE_ID, redis_dao
+from app.reply_stream import Entry, decode_job, reply_stream_dao
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+async def get_matcher(session: DbSession, bot_id: int) -> CommandMatcher:
+    matcher = command_index.get(bot_id)
+    if matcher is None:
+        with span('command_index.load'):
+            matcher = await session.run_sync(command_index.load, bot_id)
+            await session.commit()
+    return matcher
+
+
+async def reply(session: DbSession, job: ReplyJob) -> None:
+    matcher = await get_matcher(session, job.bot_id)
+    with span('match'):
+        responses = [matcher.match(message) for message in job.messages]
+    replies = [
+        (job.bot_name, response) for response in responses if response is not None
+    ]
+    if not replies:
+        return
+
+    evicted = await redis_dao.publish_to_redis(
+        job.user_id,
+        job.bot_id,
+        replies,
+        job.history_size,
+        batched=len(job.messages) > 1,
+    )
+    if evicted:
+        with span('save_messages'):
+            await session.run_sync(save_messages, job.user_id, job.bot_id, evicted)
+
+
+class ReplyWorker:
+    def __init__(
+        self, consumer: str, session_factory: Callable[[], DbSession] = new_db_session
+    ) -> None:
+        self.consumer = consumer
+        self.session_factory = session_factory
+
+    async def handle(self, job: ReplyJob) -> None:
+        async with create_db_session(self.session_factory) as session:
+            await reply(session, job)
+
+    async def process(self, entries: Sequence[Entry]) -> None:
+        done: List[bytes] = []
+        for entry_id, fields in entries:
+            try:
+                job = decode_job(fields)
+            except (KeyError, TypeError, ValueError):
+                logger.exception('Dropping malformed reply %s', entry_id)
+                done.append(entry_id)
+                continue
+            try:
+                await self.handle(job)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to reply to %s', entry_id)
+                continue
+            done.append(entry_id)
+        if done:
+            await reply_stream_dao.ack_replies(done)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        latest_id = '0'
+        next_claim = loop.time() + settings.reply_claim_interval
+        while True:
+            try:
+                if latest_id == '>' and loop.time() >= next_claim:
+                    next_claim = loop.time() + settings.reply_claim_interval
+                    entries = await reply_stream_dao.claim_replies(self.consumer)
+                else:
+                    entries = await reply_stream_dao.read_replies(
+                        self.consumer, latest_id
+                    )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to read replies for %s', self.consumer)
+                await asyncio.sleep(1)
+                continue
+
+            if latest_id == '0' and not entries:
+                latest_id = '>'
+            await self.process(entries)
+
+
+class ReplyWorkerPool:
+    def __init__(self) -> None:
+        self.tasks: List['asyncio.Task[None]'] = []
+
+    async def start(self, workers: int) -> None:
+        if self.tasks or workers <= 0:
+            return
+        await reply_stream_dao.create_reply_group()
+        self.tasks = [
+            asyncio.create_task(ReplyWorker(f'{NODE_ID}:{i}').run())
+            for i in range(workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+
+reply_workers = ReplyWorkerPool()
+
+
+async def run_workers(workers: Optional[int] = None) -> None:
+    await redis_dao.init_conn()
+    await redis_dao.claim_worker_id()
+    await redis_dao.subscribe_invalidations(manager)
+    await reply_workers.start(workers or settings.reply_workers or 1)
+    try:
+        await asyncio.gather(*reply_workers.tasks)
+    finally:
+        await reply_workers.stop()
+        await redis_dao.close_redis_connection()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_workers())
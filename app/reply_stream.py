@@ -0,0 +1,112 @@
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+from aioredis import ReplyError
+
+from app.config import settings
+from app.framing import pack, unpack
+from app.metrics import redis_timed
+from app.pydantic_models import ReplyJob
+from app.redis_utils import RedisDao, redis_dao
+
+logger = logging.getLogger(__name__)
+
+Entry = Tuple[bytes, Dict[bytes, bytes]]
+
+
+def decode_job(fields: Dict[bytes, bytes]) -> ReplyJob:
+    return ReplyJob(
+        user_id=int(fields[b'user_id']),
+        bot_id=int(fields[b'bot_id']),
+        bot_name=fields[b'bot_name'].decode(),
+        history_size=int(fields[b'history_size']),
+        messages=unpack(fields[b'messages']),
+    )
+
+
+class ReplyStreamDao:
+    def __init__(self, dao: RedisDao) -> None:
+        self.dao = dao
+
+    @property
+    def redis(self) -> Any:
+        return self.dao.redis
+
+    @redis_timed('enqueue_reply')
+    async def enqueue_reply(self, job: ReplyJob) -> None:
+        await self.redis.xadd(
+            settings.reply_stream,
+            {
+                'user_id': job.user_id,
+                'bot_id': job.bot_id,
+                'bot_name': job.bot_name,
+                'history_size': job.history_size,
+                'messages': pack(job.messages),
+            },
+            max_len=settings.reply_stream_max_len,
+        )
+
+    async def create_reply_group(self) -> None:
+        try:
+            await self.redis.xgroup_create(
+                settings.reply_stream,
+                settings.reply_group,
+                latest_id='0',
+                mkstream=True,
+            )
+        except ReplyError as e:
+            if not str(e).startswith('BUSYGROUP'):
+                raise
+
+    async def read_replies(self, consumer: str, latest_id: str = '>') -> List[Entry]:
+        entries = await self.redis.xread_group(
+            settings.reply_group,
+            consumer,
+            [settings.reply_stream],
+            timeout=settings.reply_block_ms,
+            count=settings.reply_batch_size,
+            latest_ids=[latest_id],
+        )
+        return [(entry_id, fields) for _, entry_id, fields in entries]
+
+    @redis_timed('ack_replies')
+    async def ack_replies(self, entry_ids: Sequence[bytes]) -> None:
+        await self.redis.xack(settings.reply_stream, settings.reply_group, *entry_ids)
+
+    @redis_timed('claim_replies')
+    async def claim_replies(self, consumer: str) -> List[Entry]:
+        pending = await self.redis.xpending(
+            settings.reply_stream,
+            settings.reply_group,
+            '-',
+            '+',
+            settings.reply_batch_size,
+        )
+        stale: List[bytes] = []
+        dropped: List[bytes] = []
+        for entry_id, _, idle_ms, deliveries in pending:
+            if idle_ms < settings.reply_claim_idle_ms:
+                continue
+            if deliveries >= settings.reply_max_deliveries:
+                dropped.append(entry_id)
+            else:
+                stale.append(entry_id)
+        if dropped:
+            logger.error(
+                'Dropping replies delivered %d times: %s',
+                settings.reply_max_deliveries,
+                dropped,
+            )
+            await self.ack_replies(dropped)
+        if not stale:
+            return []
+        return await self.redis.xclaim(
+            settings.reply_stream,
+            settings.reply_group,
+            consumer,
+            settings.reply_claim_idle_ms,
+            *stale,
+        )
+
+
+reply_stream_dao = ReplyStreamDao(redis_dao)
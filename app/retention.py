@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from time import time
+from typing import Callable, Optional
+
+from app.db_utils import DbSession, create_db_session, new_db_session, prune_messages
+
+logger = logging.getLogger(__name__)
+
+
+class MessagePruner:
+    def __init__(
+        self, session_factory: Callable[[], DbSession] = new_db_session
+    ) -> None:
+        self.session_factory = session_factory
+        self.task: Optional['asyncio.Task[None]'] = None
+
+    def start(self, interval: int) -> None:
+        if self.task is None and interval > 0:
+            self.task = asyncio.create_task(self.run(interval))
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    async def run(self, interval: int) -> None:
+        while True:
+            try:
+                await self.prune()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Failed to prune expired messages')
+            await asyncio.sleep(interval)
+
+    async def prune(self) -> int:
+        async with create_db_session(self.session_factory) as session:
+            deleted = await session.run_sync(prune_messages, time())
+        if deleted:
+            logger.info('Pruned %d expired messages', deleted)
+        return deleted
+
+
+message_pruner = MessagePruner()
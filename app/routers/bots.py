@@ -1,167 +1,290 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional, Union
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
 from sqlalchemy.orm.exc import NoResultFound
 from starlette import status
 
+from app.app_utils import etag_matches, iter_lines, make_etag
 from app.authentication import get_current_user, verify_role_admin
-from app.db_models import Bot, Command, User
-from app.db_utils import get_session
+from app.bot_utils import (
+    EXPORT_FORMATS,
+    add_command,
+    create_bot,
+    create_bots,
+    delete_command,
+    edit_command,
+    export_commands,
+    get_bot_name,
+    list_bot_commands,
+    list_bots,
+)
+from app.cache import bot_list_cache, command_index
+from app.config import (
+    BOTS_PAGE_SIZE,
+    COMMANDS_PAGE_SIZE,
+    MAX_BOTS_PAGE_SIZE,
+    MAX_COMMANDS_PAGE_SIZE,
+)
+from app.db_utils import DbSession, get_session
+from app.metrics import TimedRoute
 from app.pydantic_models import (
     AddBotCommandResponse,
     AddBotModel,
     AddBotResponse,
+    BotResponse,
     CommandModel,
     DeleteBotCommandResponse,
     EditBotCommandModel,
     EditBotCommandResponse,
     GetBotCommandsResponse,
     GetBotsResponse,
+    ImportBotsResponse,
+    Principal,
 )
+from app.redis_utils import redis_dao
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.get('/bots')
-def get_bots(
-    _: User = Depends(get_current_user), session: Session = Depends(get_session)
-) -> GetBotsResponse:
-    bots = session.query(Bot).all()
-
-    result = []
-    for bot in bots:
-        result.append(
-            {
-                'bot_id': bot.id,
-                'bot_name': bot.name,
-                'author_username': bot.author.username,
-            }
-        )
+async def get_bots(
+    name: Optional[str] = None,
+    after: int = -1,
+    limit: int = Query(BOTS_PAGE_SIZE, gt=0, le=MAX_BOTS_PAGE_SIZE),
+    _: Principal = Depends(get_current_user),
+    session: DbSession = Depends(get_session),
+) -> Response:
+    page = bot_list_cache.get(name, after, limit)
+    if page is None:
+        rows = await session.run_sync(list_bots, name, after, limit + 1)
+        bots = [
+            BotResponse(bot_id=bot_id, bot_name=bot_name, author_username=username)
+            for bot_id, bot_name, username in rows[:limit]
+        ]
+        next_cursor = bots[-1].bot_id if len(rows) > limit else None
+        page = GetBotsResponse(bots=bots, next_cursor=next_cursor).json().encode()
+        bot_list_cache.put(name, after, limit, page)
 
-    return GetBotsResponse(bots=result)
+    return Response(content=page, media_type='application/json')
 
 
 @router.post('/bots')
-def add_bot(
+async def add_bot(
     bot_model: AddBotModel,
-    current_user: User = Depends(verify_role_admin),
-    session: Session = Depends(get_session),
+    current_user: Principal = Depends(verify_role_admin),
+    session: DbSession = Depends(get_session),
 ) -> AddBotResponse:
+    try:
+        bot_id = await session.run_sync(create_bot, bot_model, current_user.id)
+    except IntegrityError as e:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Command already exists',
+        ) from e
 
-    bot = Bot(name=bot_model.name, author_id=current_user.id)
-    session.add(bot)
-    session.commit()
+    command_index.invalidate(bot_id)
+    bot_list_cache.clear()
+    await redis_dao.publish_invalidation(bot_id)
 
-    # await redis_dao.add_bot_commands_list(bot.id, bot_model.commands)
-    for command in bot_model.commands:
-        new_command = Command(
-            message=command.command, response=command.response, bot_id=bot.id
+    return AddBotResponse(
+        bot_id=bot_id, name=bot_model.name, author=current_user.username
+    )
+
+
+@router.post('/bots/import')
+async def import_bots(
+    request: Request,
+    current_user: Principal = Depends(verify_role_admin),
+    session: DbSession = Depends(get_session),
+) -> ImportBotsResponse:
+    bot_models: List[AddBotModel] = []
+    line_number = 0
+    try:
+        async for line in iter_lines(request.stream()):
+            line_number += 1
+            if line.strip():
+                bot_models.append(AddBotModel.parse_raw(line))
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={'line': line_number, 'errors': e.errors()},
+        ) from e
+
+    try:
+        bot_ids, imported_commands = await session.run_sync(
+            create_bots, bot_models, current_user.id
         )
-        session.add(new_command)
+    except IntegrityError as e:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail='Command already exists',
+        ) from e
+
+    bot_list_cache.clear()
+    await redis_dao.publish_invalidations(bot_ids)
+
+    return ImportBotsResponse(
+        imported_bots=bot_ids, imported_commands=imported_commands
+    )
 
-    session.commit()
 
-    return AddBotResponse(bot_id=bot.id, name=bot.name, author=bot.author.username)
+class CommandsPage:
+    def __init__(
+        self,
+        prefix: Optional[str] = None,
+        cursor: int = -1,
+        limit: int = Query(COMMANDS_PAGE_SIZE, gt=0, le=MAX_COMMANDS_PAGE_SIZE),
+    ) -> None:
+        self.prefix = prefix
+        self.cursor = cursor
+        self.limit = limit
 
 
 @router.get('/bots/{bot_id}/commands')
-def get_bot_commands(
+async def get_bot_commands(
+    bot_id: int,
+    response: Response,
+    page: CommandsPage = Depends(),
+    if_none_match: Optional[str] = Header(None),
+    _: Principal = Depends(get_current_user),
+    session: DbSession = Depends(get_session),
+) -> Union[GetBotCommandsResponse, Response]:
+    bot_name, version = command_index.commands_versions.get(bot_id) or (
+        await session.run_sync(command_index.load_commands_version, bot_id)
+    )
+    etag = make_etag(bot_id, version, page.prefix, page.cursor, page.limit)
+    if etag_matches(if_none_match, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag}
+        )
+
+    commands = await session.run_sync(
+        list_bot_commands, bot_id, page.prefix, page.cursor, page.limit + 1
+    )
+    limit = page.limit
+    next_cursor = commands[limit - 1]['command_id'] if len(commands) > limit else None
+
+    response.headers['ETag'] = etag
+    return GetBotCommandsResponse(
+        bot_name=bot_name, commands=commands[:limit], next_cursor=next_cursor
+    )
+
+
+@router.get('/bots/{bot_id}/commands/export')
+async def export_bot_commands(
     bot_id: int,
-    _: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
-) -> GetBotCommandsResponse:
-    bot = session.query(Bot).get(bot_id)
-    commands = session.query(Command).filter_by(bot_id=bot_id).all()
-    # commands = await redis_dao.get_bot_commands(bot_id)
-    result = []
-    for command in commands:
-        result.append(
-            {
-                'command_id': command.id,
-                'command': command.message,
-                'response': command.response,
-            }
+    export_format: str = Query('ndjson', alias='format', regex='^(ndjson|csv)$'),
+    _: Principal = Depends(get_current_user),
+    session: DbSession = Depends(get_session),
+) -> StreamingResponse:
+    bot_name = await session.run_sync(get_bot_name, bot_id)
+    if bot_name is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Bot does not exist',
         )
 
-    return GetBotCommandsResponse(bot_name=bot.name, commands=result)
+    media_type = EXPORT_FORMATS[export_format][1]
+    return StreamingResponse(
+        export_commands(session, bot_id, export_format),
+        media_type=media_type,
+        headers={
+            'Content-Disposition': (
+                f'attachment; filename="bot-{bot_id}-commands.{export_format}"'
+            )
+        },
+    )
 
 
 @router.post('/bots/{bot_id}/commands')
-def add_bot_command(
+async def add_bot_command(
     bot_id: int,
     command_model: CommandModel,
-    current_user: User = Depends(verify_role_admin),
-    session: Session = Depends(get_session),
+    current_user: Principal = Depends(verify_role_admin),
+    session: DbSession = Depends(get_session),
 ) -> AddBotCommandResponse:
-    bot = session.query(Bot).get(bot_id)
+    bot_name = await session.run_sync(get_bot_name, bot_id)
 
     try:
-        command = Command(
-            message=command_model.command,
-            response=command_model.response,
-            bot_id=bot_id,
-        )
-        session.add(command)
-        session.commit()
-        # await redis_dao.add_bot_command(bot_id, command_model)
+        await session.run_sync(add_command, bot_id, command_model)
     except IntegrityError as e:
-        session.rollback()
+        await session.rollback()
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail='Command already exists',
         ) from e
 
+    command_index.set_command(
+        bot_id, command_model.command, command_model.match_type, command_model.response
+    )
+    await redis_dao.publish_invalidation(bot_id)
+
     return AddBotCommandResponse(
-        bot_name=bot.name,
+        bot_name=bot_name,
         added_command=command_model.dict(),
         author_username=current_user.username,
     )
 
 
 @router.patch('/bots/{bot_id}/commands/{command_id}')
-def edit_bot_command(
+async def edit_bot_command(
     bot_id: int,
     command_id: int,
     model: EditBotCommandModel,
-    _: User = Depends(verify_role_admin),
-    session: Session = Depends(get_session),
+    _: Principal = Depends(verify_role_admin),
+    session: DbSession = Depends(get_session),
 ) -> EditBotCommandResponse:
-    bot = session.query(Bot).get(bot_id)
+    bot_name = await session.run_sync(get_bot_name, bot_id)
 
     try:
-        # await redis_dao.edit_bot_command(bot_id, command_id, model.new_response)
-        command = session.query(Command).filter_by(id=command_id).one()
-        command.response = model.new_response
-        session.commit()
+        command_bot_id, message, match_type = await session.run_sync(
+            edit_command, command_id, model.new_response
+        )
     except NoResultFound as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Command does not exist',
         ) from e
 
+    command_index.set_command(command_bot_id, message, match_type, model.new_response)
+    await redis_dao.publish_invalidation(command_bot_id)
+
     return EditBotCommandResponse(
-        bot_name=bot.name, command=command.message, new_response=command.response
+        bot_name=bot_name, command=message, new_response=model.new_response
     )
 
 
 @router.delete('/bots/{bot_id}/commands/{command_id}')
-def delete_bot_command(
+async def delete_bot_command(
     bot_id: int,
     command_id: int,
-    _: User = Depends(verify_role_admin),
-    session: Session = Depends(get_session),
+    _: Principal = Depends(verify_role_admin),
+    session: DbSession = Depends(get_session),
 ) -> DeleteBotCommandResponse:
-    bot = session.query(Bot).get(bot_id)
+    bot_name = await session.run_sync(get_bot_name, bot_id)
 
     try:
-        command = session.query(Command).filter_by(id=command_id).one()
-        session.delete(command)
-        session.commit()
-        # await redis_dao.delete_bot_command(bot_id, command_id)
+        command_bot_id, message = await session.run_sync(delete_command, command_id)
     except NoResultFound as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Command does not exist',
         ) from e
 
-    return DeleteBotCommandResponse(bot_name=bot.name, deleted_command_id=command_id)
+    command_index.remove_command(command_bot_id, message)
+    await redis_dao.publish_invalidation(command_bot_id)
+
+    return DeleteBotCommandResponse(bot_name=bot_name, deleted_command_id=command_id)
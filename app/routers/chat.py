@@ -1,22 +1,53 @@
-import asyncio
+from typing import Dict, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from app.authentication import get_current_user
+from app.authentication import get_current_user, verify_role_admin
+from app.config import (
+    HISTORY_PAGE_SIZE,
+    MAX_HISTORY_PAGE_SIZE,
+    MSGPACK_SUBPROTOCOL,
+    settings,
+)
 from app.connection_manager import manager
-from app.db_models import Bot, Command, RoleEnum, User
-from app.db_utils import get_session
-from app.pydantic_models import GetHistoryResponse
+from app.db_models import Bot, RoleEnum
+from app.db_utils import DbSession, get_messages_before, get_session, save_messages
+from app.framing import FrameError, receive_batch, unpack_batch
+from app.metrics import MESSAGES_IN, TimedRoute
+from app.presence import presence_dao
+from app.pydantic_models import (
+    GetHistoryResponse,
+    HistoryMessage,
+    Principal,
+    ReplyJob,
+    SessionsResponse,
+)
 from app.redis_utils import redis_dao
+from app.replies import get_matcher
+from app.reply_stream import reply_stream_dao
+from app.tracing import span, tracer
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+
+class HistoryPage:
+    def __init__(
+        self,
+        before: Optional[int] = None,
+        limit: int = Query(HISTORY_PAGE_SIZE, gt=0, le=MAX_HISTORY_PAGE_SIZE),
+    ) -> None:
+        self.before = before
+        self.limit = limit
 
 
 @router.get('/bots/{bot_id}/messages/{user_id}')
 async def get_messages(
-    bot_id: int, user_id: int, current_user: User = Depends(get_current_user)
+    bot_id: int,
+    user_id: int,
+    page: HistoryPage = Depends(),
+    current_user: Principal = Depends(get_current_user),
+    session: DbSession = Depends(get_session),
 ) -> GetHistoryResponse:
     if current_user.id != user_id or current_user.role != RoleEnum.ADMIN:
         raise HTTPException(
@@ -24,40 +55,119 @@ async def get_messages(
             detail='Permission denied',
         )
 
-    history = await redis_dao.get_history_from_redis(user_id, bot_id)
-    return GetHistoryResponse(history=history)
+    before, limit = page.before, page.limit
+    hot = await redis_dao.get_history_from_redis(user_id, bot_id)
+    history = [record for record in hot if before is None or record['id'] < before]
+    history = history[-limit:]
+
+    if len(history) < limit:
+        cold = await session.run_sync(
+            get_messages_before,
+            user_id,
+            bot_id,
+            history[0]['id'] if history else before,
+            limit - len(history),
+        )
+        history = cold + history
+
+    next_cursor = history[0]['id'] if history and len(history) == limit else None
+    return GetHistoryResponse(
+        history=[HistoryMessage(**record) for record in history],
+        next_cursor=next_cursor,
+    )
+
+
+@router.get('/sessions')
+async def get_sessions(
+    _: Principal = Depends(verify_role_admin),
+) -> SessionsResponse:
+    presence = await presence_dao.get_sessions()
+    bots: Dict[int, int] = {}
+    nodes: Dict[str, int] = {}
+    for node, rooms in presence.items():
+        nodes[node] = sum(rooms.values())
+        for room, count in rooms.items():
+            bot_id = int(room.split(':')[1])
+            bots[bot_id] = bots.get(bot_id, 0) + count
+    return SessionsResponse(total=sum(nodes.values()), bots=bots, nodes=nodes)
+
+
+async def get_chat_bot(session: DbSession, bot_id: int) -> Optional[Tuple[str, int]]:
+    bot = await session.run_sync(
+        lambda s: s.query(Bot.name, Bot.history_size).filter_by(id=bot_id).first()
+    )
+    await session.commit()
+    if bot is None:
+        return None
+    return bot.name, bot.history_size or settings.history_size
+
+
+async def dispatch(session: DbSession, job: ReplyJob, sender: str) -> None:
+    if settings.reply_queue:
+        messages = unpack_batch(job.messages, sender, job.bot_name)
+    else:
+        matcher = await get_matcher(session, job.bot_id)
+        with span('match'):
+            messages = unpack_batch(job.messages, sender, job.bot_name, matcher)
+    evicted = await redis_dao.publish_to_redis(
+        job.user_id,
+        job.bot_id,
+        messages,
+        job.history_size,
+        batched=len(job.messages) > 1,
+    )
+    if settings.reply_queue:
+        await reply_stream_dao.enqueue_reply(job)
+    if evicted:
+        with span('save_messages'):
+            await session.run_sync(save_messages, job.user_id, job.bot_id, evicted)
 
 
 @router.websocket('/ws/{bot_id}')
 async def websocket_endpoint(
     websocket: WebSocket,
     bot_id: int,
-    current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    current_user: Principal = Depends(get_current_user),
+    session: DbSession = Depends(get_session),
 ) -> None:
-    await manager.connect(websocket)
     user_id = current_user.id
-    user_full_name = current_user.full_name
-    bot_name = await asyncio.get_running_loop().run_in_executor(
-        None, lambda: session.query(Bot).get(bot_id).name
+    bot = await get_chat_bot(session, bot_id)
+    if bot is None:
+        await websocket.close(status.WS_1008_POLICY_VIOLATION)
+        return
+
+    bot_name, history_size = bot
+    traced = websocket.scope.get('trace', False)
+    binary = MSGPACK_SUBPROTOCOL in websocket.scope.get('subprotocols', ())
+    await manager.connect(
+        websocket, user_id, bot_id, MSGPACK_SUBPROTOCOL if binary else None
     )
 
+    await redis_dao.subscribe(manager, user_id, bot_id)
+    await presence_dao.add_presence(user_id, bot_id)
+    code = status.WS_1000_NORMAL_CLOSURE
     try:
-        await redis_dao.create_reader_task(manager, user_id, bot_id)
         while True:
-            message = await websocket.receive_text()
-            await redis_dao.publish_to_redis(user_id, bot_id, user_full_name, message)
-            # bot_response = await redis_dao.get_bot_response_by_message(bot_id, message)
-            bot_command = await asyncio.get_running_loop().run_in_executor(
-                None,
-                lambda: session.query(Command)
-                .filter_by(bot_id=bot_id, message=message)
-                .one_or_none(),
+            batch = await receive_batch(websocket, binary)
+            if not batch:
+                continue
+            MESSAGES_IN.inc(len(batch))
+            job = ReplyJob.construct(
+                user_id=user_id,
+                bot_id=bot_id,
+                bot_name=bot_name,
+                history_size=history_size,
+                messages=batch,
             )
-            if bot_command:
-                await redis_dao.publish_to_redis(
-                    user_id, bot_id, bot_name, bot_command.response
-                )
-
+            with tracer.trace(
+                'ws.message', traced, bot_id=bot_id, user_id=user_id, size=len(batch)
+            ):
+                await dispatch(session, job, current_user.full_name)
+    except FrameError as e:
+        code = e.code
     except WebSocketDisconnect:
-        await manager.disconnect(websocket)
+        pass
+    finally:
+        await manager.disconnect(websocket, user_id, bot_id, code)
+        await presence_dao.remove_presence(user_id, bot_id)
+        await redis_dao.unsubscribe(user_id, bot_id)
@@ -3,25 +3,31 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
 from starlette import status
 
-from app.app_utils import get_password_hash
+from app.app_utils import password_hasher
 from app.authentication import authenticate_user, create_access_token, get_current_user
 from app.config import settings
 from app.db_models import RoleEnum, User
-from app.db_utils import get_session, get_user
-from app.pydantic_models import RegisterModel, RegisterResponse, Token, UserIdModel
+from app.db_utils import DbSession, add_user, get_session, get_user
+from app.metrics import TimedRoute
+from app.pydantic_models import (
+    Principal,
+    RegisterModel,
+    RegisterResponse,
+    Token,
+    UserIdModel,
+)
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.post('/token')
-def login_for_access_token(
-    session: Session = Depends(get_session),
+async def login_for_access_token(
+    session: DbSession = Depends(get_session),
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> Token:
-    user = authenticate_user(session, form_data.username, form_data.password)
+    user = await authenticate_user(session, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -38,15 +44,17 @@ def login_for_access_token(
 
 
 @router.get('/users/me')
-def read_users_me(current_user: User = Depends(get_current_user)) -> UserIdModel:
+async def read_users_me(
+    current_user: Principal = Depends(get_current_user),
+) -> UserIdModel:
     return UserIdModel(user_id=current_user.id, role=current_user.role)
 
 
 @router.post('/register')
-def register(
-    data: RegisterModel, session: Session = Depends(get_session)
+async def register(
+    data: RegisterModel, session: DbSession = Depends(get_session)
 ) -> RegisterResponse:
-    if get_user(session, data.username):
+    if await session.run_sync(get_user, data.username):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Couldn't register user",
@@ -54,18 +62,17 @@ def register(
 
     user = User(
         username=data.username,
-        hashed_password=get_password_hash(data.password),
+        hashed_password=await password_hasher.hash(data.password),
         full_name=data.full_name,
         role=RoleEnum.USER,
     )
 
     try:
-        session.add(user)
-        session.commit()
+        await session.run_sync(add_user, user)
     except IntegrityError as e:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Couldn't register user",
         ) from e
 
-    return RegisterResponse(registered_username=user.username)
+    return RegisterResponse(registered_username=data.username)
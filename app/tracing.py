@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import random
+import uuid
+from contextvars import ContextVar
+from time import perf_counter, time
+from typing import Any, Awaitable, Callable, Dict, List, MutableMapping, Optional
+
+from app.config import settings
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # pragma: no cover
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class Trace:
+    def __init__(self, name: str, attributes: Dict[str, Any]) -> None:
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time()
+        self.started = perf_counter()
+        self.duration = 0.0
+        self.spans: List[Dict[str, Any]] = []
+        self.profiler: Optional[Any] = None
+
+    def add_span(self, name: str, started: float, finished: float) -> None:
+        self.spans.append(
+            {
+                'name': name,
+                'offset_ms': round((started - self.started) * 1000, 3),
+                'duration_ms': round((finished - started) * 1000, 3),
+            }
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes,
+            'spans': self.spans,
+        }
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+class NullContext:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+
+NULL_CONTEXT = NullContext()
+
+
+class SpanContext:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: Trace, name: str) -> None:
+        self.trace = trace
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        self.started = perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.trace.add_span(self.name, self.started, perf_counter())
+
+
+def span(name: str) -> Any:
+    trace = current_trace.get()
+    if trace is None:
+        return NULL_CONTEXT
+    return SpanContext(trace, name)
+
+
+def record_span(name: str, started: float, finished: float) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, finished)
+
+
+class TraceContext:
+    def __init__(self, owner: 'Tracer', trace: Trace) -> None:
+        self.tracer = owner
+        self.trace = trace
+        self.token: Any = None
+
+    def __enter__(self) -> Trace:
+        if self.tracer.profile and Profiler is not None:
+            self.trace.profiler = Profiler(async_mode='enabled')
+            self.trace.profiler.start()
+        self.token = current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc_info: Any) -> None:
+        current_trace.reset(self.token)
+        self.tracer.finish(self.trace)
+
+
+class Tracer:
+    def __init__(
+        self,
+        sample_rate: float,
+        header: Optional[str],
+        slow_ms: float,
+        log_path: str,
+        profile: bool = False,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode() if header else None
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self.profile = profile
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.header is not None
+
+    def requested(self, scope: Scope) -> bool:
+        if self.header is None:
+            return False
+        return any(
+            name == self.header and value not in (b'', b'0')
+            for name, value in scope['headers']
+        )
+
+    def sampled(self, forced: bool = False) -> bool:
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def trace(self, name: str, forced: bool = False, **attributes: Any) -> Any:
+        if not self.sampled(forced):
+            return NULL_CONTEXT
+        return TraceContext(self, Trace(name, attributes))
+
+    def finish(self, trace: Trace) -> None:
+        trace.duration = perf_counter() - trace.started
+        if trace.profiler is not None:
+            trace.profiler.stop()
+        if trace.duration * 1000 < self.slow_ms:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.write(trace)
+            return
+        loop.run_in_executor(None, self.write, trace)
+
+    def write(self, trace: Trace) -> None:
+        record = trace.to_dict()
+        if trace.profiler is not None:
+            record['profile'] = trace.profiler.output_text()
+        try:
+            with open(self.log_path, 'a', encoding='utf-8') as log:
+                log.write(json.dumps(record, default=str) + '\n')
+        except OSError:
+            logger.exception('Failed to write trace %s', trace.trace_id)
+
+
+tracer = Tracer(
+    settings.trace_sample_rate,
+    settings.trace_header,
+    settings.trace_slow_ms,
+    settings.trace_log_path,
+    settings.trace_profile,
+)
+
+
+class TracingMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not tracer.enabled or scope['type'] not in ('http', 'websocket'):
+            await self.app(scope, receive, send)
+            return
+
+        forced = tracer.requested(scope)
+        if scope['type'] == 'websocket':
+            scope['trace'] = forced
+            await self.app(scope, receive, send)
+            return
+        if not tracer.sampled(forced):
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f'{scope["method"]} {scope["path"]}', {})
+        with TraceContext(tracer, trace):
+
+            async def send_traced(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    trace.attributes['status'] = message['status']
+                    message['headers'] = [
+                        *message.get('headers', []),
+                        (b'x-trace-id', trace.trace_id.encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_traced)
@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import json
+import math
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import msgpack
+from aiohttp import ClientError, ClientSession, ClientTimeout, WSMsgType
+
+from client.run import MSGPACK_SUBPROTOCOL, SERVER_URL
+
+MAX_RETRIES = 5
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    rank = math.ceil(q / 100 * len(ordered)) - 1
+    return ordered[min(len(ordered) - 1, max(0, rank))]
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, name: str, started: float) -> None:
+        self.latencies[name].append(time.perf_counter() - started)
+
+    def error(self, name: str) -> None:
+        self.errors[name] += 1
+
+    def report(self, elapsed: float) -> str:
+        lines = [
+            f'{"operation":<12}{"count":>8}{"errors":>8}'
+            f'{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}'
+        ]
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = self.latencies[name]
+            quantiles = (
+                [percentile(values, q) * 1000 for q in (50, 95, 99)]
+                if values
+                else [math.nan] * 3
+            )
+            lines.append(
+                f'{name:<12}{len(values):>8}{self.errors[name]:>8}'
+                + ''.join(f'{value:>10.1f}' for value in quantiles)
+                + f'{len(values) / elapsed:>10.1f}'
+            )
+        return '\n'.join(lines)
+
+
+async def timed_request(
+    stats: Stats,
+    name: str,
+    session: ClientSession,
+    method: str,
+    url: str,
+    **kwargs: Any,
+) -> Any:
+    for _ in range(MAX_RETRIES):
+        started = time.perf_counter()
+        async with session.request(method, url, **kwargs) as response:
+            if response.status == 503:
+                await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+                continue
+            response.raise_for_status()
+            payload = await response.json()
+            stats.record(name, started)
+            return payload
+    raise RuntimeError(f'{name}: server stayed overloaded')
+
+
+async def receive_frames(websocket: Any, count: int) -> None:
+    for _ in range(count):
+        msg = await websocket.receive()
+        if msg.type not in (WSMsgType.TEXT, WSMsgType.BINARY):
+            raise ConnectionError(f'Websocket closed: {msg.type}')
+
+
+async def sign_up(
+    stats: Stats, session: ClientSession, server_url: str, username: str, password: str
+) -> Dict[str, str]:
+    await timed_request(
+        stats,
+        'register',
+        session,
+        'POST',
+        f'{server_url}/register',
+        json={'username': username, 'password': password, 'full_name': username},
+    )
+    token = await timed_request(
+        stats,
+        'token',
+        session,
+        'POST',
+        f'{server_url}/token',
+        data={'username': username, 'password': password},
+    )
+    return {'Authorization': f'Bearer {token["access_token"]}'}
+
+
+async def chat(
+    stats: Stats, session: ClientSession, args: argparse.Namespace, auth: Dict[str, str]
+) -> None:
+    ws_url = args.server_url.replace('http', 'ws', 1) + f'/ws/{args.bot_id}'
+    interval = 1 / args.rate
+    payload: Any = [args.message] * args.batch if args.batch > 1 else args.message
+    replies = min(args.replies, 1) if args.batch > 1 else args.replies
+    frames = 1 + replies if args.reply_queue or args.batch == 1 else 1
+    started = time.perf_counter()
+    protocols = (MSGPACK_SUBPROTOCOL,) if args.msgpack else ()
+    async with session.ws_connect(
+        ws_url,
+        headers=auth,
+        autoclose=False,
+        protocols=protocols,
+        compress=15 if args.deflate else 0,
+    ) as websocket:
+        stats.record('ws_connect', started)
+        for _ in range(args.messages):
+            started = time.perf_counter()
+            if websocket.protocol == MSGPACK_SUBPROTOCOL:
+                await websocket.send_bytes(msgpack.packb(payload))
+            elif args.batch > 1:
+                await websocket.send_str(json.dumps(payload))
+            else:
+                await websocket.send_str(payload)
+            try:
+                await asyncio.wait_for(receive_frames(websocket, frames), args.timeout)
+                stats.record('ws_rtt', started)
+            except asyncio.TimeoutError:
+                stats.error('ws_rtt')
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+        await websocket.close()
+
+
+async def simulate_user(stats: Stats, args: argparse.Namespace, index: int) -> None:
+    await asyncio.sleep(args.ramp * index / args.users)
+    async with ClientSession(timeout=ClientTimeout(total=args.timeout)) as session:
+        try:
+            auth = await sign_up(
+                stats, session, args.server_url, f'{args.prefix}-{index}', args.password
+            )
+            await timed_request(
+                stats,
+                'commands',
+                session,
+                'GET',
+                f'{args.server_url}/bots/{args.bot_id}/commands',
+                headers=auth,
+            )
+            await chat(stats, session, args, auth)
+        except (ClientError, asyncio.TimeoutError, ConnectionError, RuntimeError):
+            stats.error('session')
+
+
+async def serve_in_process(port: int) -> Tuple[Any, 'asyncio.Task[None]']:
+    # pylint: disable=import-outside-toplevel
+    import uvicorn
+    from fakeredis import aioredis
+
+    from app.db_utils import init_db
+    from app.factory import create_app
+    from app.redis_utils import redis_dao
+
+    init_db()
+    redis_dao.redis = await aioredis.create_redis_pool()
+    server = uvicorn.Server(
+        uvicorn.Config(create_app(), host='127.0.0.1', port=port, log_level='warning')
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            await task
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run_load(args: argparse.Namespace) -> None:
+    server: Optional[Any] = None
+    server_task: Optional['asyncio.Task[None]'] = None
+    if args.in_process:
+        server, server_task = await serve_in_process(args.port)
+        args.server_url = f'http://127.0.0.1:{args.port}'
+
+    stats = Stats()
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(stats, args, i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    print(f'{args.users} users, {args.messages} messages each, {elapsed:.1f}s')
+    print(stats.report(elapsed))
+
+    if server is not None and server_task is not None:
+        server.should_exit = True
+        await server_task
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Chat bot manager load generator')
+    parser.add_argument('--server-url', default=SERVER_URL)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=5.0, help='messages/s per user')
+    parser.add_argument('--ramp', type=float, default=0.0, help='seconds to start all')
+    parser.add_argument('--bot-id', type=int, default=0)
+    parser.add_argument('--message', default='Hey')
+    parser.add_argument('--replies', type=int, default=1, help='bot frames per message')
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--batch', type=int, default=1, help='messages per frame')
+    parser.add_argument(
+        '--reply-queue',
+        action='store_true',
+        help='server runs with REPLY_QUEUE=true: replies arrive as separate frames',
+    )
+    parser.add_argument('--msgpack', action='store_true', help='binary frames')
+    parser.add_argument('--deflate', action='store_true', help='permessage-deflate')
+    parser.add_argument('--password', default='load-test')
+    parser.add_argument('--prefix', default=f'load-{uuid.uuid4().hex[:8]}')
+    parser.add_argument(
+        '--in-process',
+        action='store_true',
+        help='serve the app in this process against fakeredis',
+    )
+    parser.add_argument('--port', type=int, default=8765)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(run_load(parse_args()))
@@ -1,10 +1,15 @@
 import asyncio
-from typing import Any, Dict, List
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
+import msgpack
 from aioconsole import ainput, aprint
 from aiohttp import ClientSession, WSMsgType
 
 SERVER_URL = 'http://127.0.0.1:8000'
+CACHE_DIR = Path.home() / '.cache' / 'chat-bot-client'
+MSGPACK_SUBPROTOCOL = 'chat.msgpack'
 
 
 async def sign_in() -> Dict[str, str]:
@@ -24,14 +29,15 @@ async def sign_in() -> Dict[str, str]:
 
 
 async def load_messages_history(
-    auth: Dict[str, str], user_id: int, bot_id: int
-) -> List[str]:
+    auth: Dict[str, str], user_id: int, bot_id: int, before: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    params = {} if before is None else {'before': before}
     async with ClientSession(headers=auth) as session:
         async with session.get(
-            f'{SERVER_URL}/bots/{bot_id}/messages/{user_id}'
+            f'{SERVER_URL}/bots/{bot_id}/messages/{user_id}', params=params
         ) as response:
             json = await response.json()
-            return json['history']
+            return json['history'], json['next_cursor']
 
 
 async def run_client(auth: Dict[str, str], bot_id: int) -> None:
@@ -40,22 +46,40 @@ async def run_client(auth: Dict[str, str], bot_id: int) -> None:
             f'{SERVER_URL}/ws/{bot_id}',
             autoclose=False,
             headers=auth,
+            protocols=(MSGPACK_SUBPROTOCOL,),
+            compress=15,
         ) as ws:
             await asyncio.gather(receive_messages(ws), send_messages(ws))
 
 
 async def receive_messages(websocket: Any) -> None:
     async for msg in websocket:
-        if msg.type == WSMsgType.TEXT:
-            await aprint(msg.data)
+        if msg.type == WSMsgType.BINARY:
+            message = msgpack.unpackb(msg.data)
+            for record in message if isinstance(message, list) else [message]:
+                await aprint(f"{record['sender']}: {record['body']}")
+        elif msg.type == WSMsgType.TEXT:
+            await aprint('\n'.join(text_lines(msg.data)))
         elif msg.type in (WSMsgType.CLOSED, WSMsgType.ERROR):
             break
 
 
+def text_lines(frame: str) -> List[str]:
+    if frame.startswith('['):
+        try:
+            return json.loads(frame)
+        except ValueError:
+            pass
+    return [frame]
+
+
 async def send_messages(websocket: Any) -> None:
     while True:
         msg = await ainput()
-        await websocket.send_str(msg)
+        if websocket.protocol == MSGPACK_SUBPROTOCOL:
+            await websocket.send_bytes(msgpack.packb(msg))
+        else:
+            await websocket.send_str(msg)
 
 
 async def get_user_id(auth: Dict[str, str]) -> int:
@@ -84,11 +108,50 @@ async def get_available_bots(auth: Dict[str, str]) -> Any:
             return json['bots']
 
 
+def commands_cache_path(bot_id: int, cursor: int) -> Path:
+    return CACHE_DIR / f'commands-{bot_id}-{cursor}.json'
+
+
+def read_cached_page(bot_id: int, cursor: int) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(commands_cache_path(bot_id, cursor).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_cached_page(
+    bot_id: int, cursor: int, etag: Optional[str], page: Dict[str, Any]
+) -> None:
+    if etag is None:
+        return
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    commands_cache_path(bot_id, cursor).write_text(
+        json.dumps({'etag': etag, 'page': page})
+    )
+
+
 async def get_available_commands(auth: Dict[str, str], bot_id: int) -> Any:
+    commands: List[Any] = []
+    cursor: Optional[int] = -1
     async with ClientSession(headers=auth) as session:
-        async with session.get(f'{SERVER_URL}/bots/{bot_id}/commands') as response:
-            json = await response.json()
-            return json['commands']
+        while cursor is not None:
+            cached = read_cached_page(bot_id, cursor)
+            headers = {'If-None-Match': cached['etag']} if cached else {}
+            async with session.get(
+                f'{SERVER_URL}/bots/{bot_id}/commands',
+                params={'cursor': cursor},
+                headers=headers,
+            ) as response:
+                if response.status == 304 and cached:
+                    page = cached['page']
+                else:
+                    page = await response.json()
+                    write_cached_page(
+                        bot_id, cursor, response.headers.get('ETag'), page
+                    )
+            commands += page['commands']
+            cursor = page['next_cursor']
+    return commands
 
 
 if __name__ == '__main__':
@@ -109,9 +172,9 @@ if __name__ == '__main__':
 
     print('Start chatting!')
 
-    history = loop.run_until_complete(load_messages_history(auth_header, user, bot))
+    history, _ = loop.run_until_complete(load_messages_history(auth_header, user, bot))
 
     for message in history:
-        print(message)
+        print(f"{message['sender']}: {message['body']}")
 
     loop.run_until_complete(run_client(auth_header, bot))
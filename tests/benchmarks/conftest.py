@@ -0,0 +1,10 @@
+# pylint: disable=redefined-outer-name
+import pytest
+
+
+@pytest.fixture()
+def run(event_loop):
+    def run_coroutine(func, *args):
+        return event_loop.run_until_complete(func(*args))
+
+    return run_coroutine
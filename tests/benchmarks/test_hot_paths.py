@@ -0,0 +1,158 @@
+# pylint: disable=redefined-outer-name
+import asyncio
+
+import pytest
+
+from app.authentication import get_current_user
+from app.cache import bot_list_cache, command_index, principal_cache
+from app.config import BOTS_PAGE_SIZE
+from app.connection_manager import ConnectionManager
+from app.db_models import Bot, Command, MatchTypeEnum
+from app.db_utils import create_db_session
+from app.framing import pack
+from app.matching import CommandMatcher
+from app.redis_utils import redis_dao
+from app.routers.bots import get_bots
+from tests.conftest import new_test_db_session
+
+MATCH_TYPES = list(MatchTypeEnum)
+
+
+class NullWebSocket:
+    async def accept(self, subprotocol=None) -> None:
+        pass
+
+    async def send_text(self, message: str) -> None:
+        pass
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+
+async def fan_out(manager, message):
+    await manager.broadcast(1, 1, message)
+    connections = tuple(manager.rooms[(1, 1)].values())
+    while any(connection.queue for connection in connections):
+        await asyncio.sleep(0)
+
+
+async def with_session(func, *args):
+    async with create_db_session(new_test_db_session) as session:
+        return await func(*args, session)
+
+
+@pytest.fixture()
+def principal(run, token_admin):
+    return run(with_session, lambda session: get_current_user(session, token_admin))
+
+
+@pytest.fixture()
+def many_commands(bot, session):
+    session.bulk_insert_mappings(
+        Command,
+        [
+            {
+                'message': f'command {i}' if i % 5 != 4 else f'order {i} #\\d+',
+                'response': f'response {i}',
+                'match_type': MATCH_TYPES[i % len(MATCH_TYPES)],
+                'bot_id': 1,
+            }
+            for i in range(1000)
+        ],
+    )
+    session.commit()
+
+
+def test_publish_to_redis(benchmark, run):
+    benchmark(
+        run,
+        redis_dao.publish_to_redis,
+        1,
+        1,
+        [('Admin', 'Hello'), ('test_bot', 'Hello from bot!')],
+        10,
+    )
+
+
+def test_get_history_from_redis(benchmark, run):
+    for i in range(5):
+        run(redis_dao.publish_to_redis, 1, 1, [('Admin', f'q{i}'), ('bot', 'a')], 10)
+
+    history = benchmark(run, redis_dao.get_history_from_redis, 1, 1)
+
+    assert len(history) == 10
+
+
+@pytest.mark.usefixtures('many_commands')
+def test_command_lookup(benchmark, session):
+    command_index.load(session, 1)
+
+    def lookup():
+        return command_index.get(1).match('please ship order 999 #42 today')
+
+    assert benchmark(lookup) == 'response 999'
+
+
+def scaled_commands(count, kind):
+    for i in range(count):
+        match_type = MatchTypeEnum.REGEX if kind == 'regex' else MATCH_TYPES[i % 5]
+        if match_type == MatchTypeEnum.REGEX:
+            yield rf'(?i)order {i} #\d+', match_type, f'response {i}'
+        else:
+            yield f'command {i} word', match_type, f'response {i}'
+
+
+@pytest.mark.parametrize('kind', ['mixed', 'regex'])
+@pytest.mark.parametrize('count', [1000, 5000, 10000])
+def test_command_lookup_scaling(benchmark, count, kind):
+    matcher = CommandMatcher(scaled_commands(count, kind))
+    matcher.compile()
+
+    def lookup():
+        return matcher.match('please ship order 999 #x today, nothing matches here')
+
+    assert benchmark(lookup) is None
+
+
+@pytest.mark.parametrize('sockets', [10, 1000, 10000])
+def test_broadcast(benchmark, run, sockets):
+    manager = ConnectionManager()
+    websockets = [NullWebSocket() for _ in range(sockets)]
+    for websocket in websockets:
+        run(manager.connect, websocket, 1, 1)
+
+    message = pack({'id': 1, 'ts': 1.0, 'sender': 'Admin', 'body': 'Hello'})
+    benchmark(run, fan_out, manager, message)
+
+    for websocket in websockets:
+        run(manager.disconnect, websocket, 1, 1)
+
+
+@pytest.mark.parametrize('cached', [True, False], ids=['cached', 'decoded'])
+def test_get_current_user(benchmark, run, token_admin, cached):
+    def authenticate():
+        return run(with_session, lambda session: get_current_user(session, token_admin))
+
+    authenticate()
+    setup = None if cached else principal_cache.clear
+    principal = benchmark.pedantic(authenticate, setup=setup, rounds=200)
+
+    assert principal.username == 'admin'
+
+
+@pytest.mark.parametrize('bots', [10, 1000, 10000])
+def test_get_bots(benchmark, run, session, principal, bots):
+    session.bulk_insert_mappings(
+        Bot, [{'id': i, 'name': f'bot {i}', 'author_id': 1} for i in range(1, bots + 1)]
+    )
+    session.commit()
+
+    def list_bots():
+        return run(
+            with_session,
+            lambda session: get_bots(None, -1, BOTS_PAGE_SIZE, principal, session),
+        )
+
+    response = benchmark.pedantic(list_bots, setup=bot_list_cache.clear, rounds=100)
+
+    assert response.status_code == 200
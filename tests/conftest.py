@@ -1,5 +1,6 @@
 # pylint: disable=redefined-outer-name
 # pylint: disable=unused-argument
+import os
 from contextlib import contextmanager
 from datetime import timedelta
 from typing import Any, Dict, Optional
@@ -8,20 +9,33 @@ import pytest
 from async_asgi_testclient import TestClient
 from fakeredis import FakeServer, aioredis
 from jose import jwt
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from app.app_utils import get_password_hash
+from app.cache import bot_list_cache, command_index, principal_cache
 from app.config import ALGORITHM, settings
-from app.db_models import Bot, Command, RoleEnum, User
-from app.db_utils import get_session
+from app.db_models import Bot, Command, Message, RoleEnum, User
+from app.db_utils import (
+    ThreadedSession,
+    create_db_session,
+    get_session,
+    make_async_engine,
+    make_engine,
+    reset_sequences,
+)
 from app.factory import create_app
 from app.redis_utils import redis_dao
+from app.retention import message_pruner
 
-test_engine = create_engine(
-    'sqlite:///test.db', connect_args={'check_same_thread': False}
-)
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', 'sqlite:///test.db')
+
+test_engine = make_engine(TEST_DATABASE_URL, pooled=False)
 TestingSessionLocal = sessionmaker(bind=test_engine)
+test_async_engine = make_async_engine(TEST_DATABASE_URL, pooled=False)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=test_async_engine, class_=AsyncSession, expire_on_commit=False
+)
 
 
 def create_access_token_without_expire(
@@ -51,8 +65,14 @@ def session():
         yield sess
 
 
-def test_session():
-    with create_test_session() as sess:
+def new_test_db_session():
+    if settings.async_db:
+        return TestingAsyncSessionLocal()
+    return ThreadedSession(TestingSessionLocal())
+
+
+async def test_session():
+    async with create_db_session(new_test_db_session) as sess:
         yield sess
 
 
@@ -67,6 +87,7 @@ def mock_auth(mocker):
 @pytest.fixture(autouse=True)
 def create_test_database(test_app):
     test_app.dependency_overrides[get_session] = test_session
+    message_pruner.session_factory = new_test_db_session
 
     import app.db_models as models  # pylint: disable=import-outside-toplevel
 
@@ -84,10 +105,18 @@ def create_test_database(test_app):
                     )
                 ]
             )
+            reset_sequences(session)
     yield
     models.Base.metadata.drop_all(test_engine)
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    command_index.clear()
+    principal_cache.clear()
+    bot_list_cache.clear()
+
+
 @pytest.fixture()
 def auth_header_user(session, token_user):
     user = User(
@@ -148,6 +177,7 @@ async def bot(session):
     bot = Bot(id=1, name='test_bot', author_id=1)
     session.add(bot)
     session.commit()
+    reset_sequences(session)
 
 
 @pytest.fixture()
@@ -155,8 +185,34 @@ async def _hello_message(bot, session):
     command = Command(id=1, message='Hello', response='Hello from bot!', bot_id=1)
     session.add(command)
     session.commit()
+    reset_sequences(session)
 
 
 @pytest.fixture()
 async def _existed_bot_message(bot):
-    await redis_dao.redis.rpush('hist:1:1', 'admin: first message')
+    await redis_dao.redis.rpush(
+        'hist:1:1', '{"id":1,"ts":1.0,"sender":"admin","body":"first message"}'
+    )
+
+
+@pytest.fixture()
+async def _long_history(bot, session):
+    session.bulk_insert_mappings(
+        Message,
+        [
+            {
+                'id': i,
+                'user_id': 1,
+                'bot_id': 1,
+                'ts': i,
+                'sender': 'admin',
+                'body': str(i),
+            }
+            for i in range(1, 4)
+        ],
+    )
+    session.commit()
+    for i in range(4, 6):
+        await redis_dao.redis.rpush(
+            'hist:1:1', f'{{"id":{i},"ts":{i},"sender":"admin","body":"{i}"}}'
+        )
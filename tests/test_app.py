@@ -1,7 +1,9 @@
 import pytest
 
 from app.app_utils import verify_password
+from app.connection_manager import manager
 from app.db_models import Command, RoleEnum, User
+from app.presence import presence_dao
 
 
 @pytest.mark.asyncio()
@@ -93,7 +95,8 @@ async def test_get_bots(client, auth_header_admin):
 
     assert response.status_code == 200
     assert response.json() == {
-        'bots': [{'bot_id': 1, 'bot_name': 'test_bot', 'author_username': 'admin'}]
+        'bots': [{'bot_id': 1, 'bot_name': 'test_bot', 'author_username': 'admin'}],
+        'next_cursor': None,
     }
 
 
@@ -121,42 +124,6 @@ async def test_add_bot_no_permission(client, auth_header_user):
     assert response.json()['detail'] == 'Permission denied'
 
 
-@pytest.mark.asyncio()
-@pytest.mark.usefixtures('_hello_message')
-async def test_get_bot_commands(client, auth_header_admin):
-    response = await client.get('/bots/1/commands', headers=auth_header_admin)
-
-    assert response.status_code == 200
-    assert response.json() == {
-        'bot_name': 'test_bot',
-        'commands': [
-            {'command_id': 1, 'command': 'Hello', 'response': 'Hello from bot!'}
-        ],
-    }
-
-
-@pytest.mark.asyncio()
-@pytest.mark.usefixtures('bot')
-async def test_add_bot_command(client, auth_header_admin, session):
-    response = await client.post(
-        '/bots/1/commands',
-        headers=auth_header_admin,
-        json={'command': 'Hi', 'response': 'Welcome'},
-    )
-
-    added_cmd_resp = (
-        session.query(Command).filter_by(bot_id=1, message='Hi').one().response
-    )
-
-    assert added_cmd_resp == 'Welcome'
-    assert response.status_code == 200
-    assert response.json() == {
-        'bot_name': 'test_bot',
-        'added_command': {'command': 'Hi', 'response': 'Welcome'},
-        'author_username': 'admin',
-    }
-
-
 @pytest.mark.asyncio()
 @pytest.mark.usefixtures('_hello_message')
 async def test_add_bot_command_not_unique(client, auth_header_admin):
@@ -268,7 +235,10 @@ async def test_get_messages_history(client, auth_header_admin):
     response = await client.get('/bots/1/messages/1', headers=auth_header_admin)
 
     assert response.status_code == 200
-    assert response.json() == {'history': ['admin: first message']}
+    assert response.json() == {
+        'history': [{'id': 1, 'ts': 1.0, 'sender': 'admin', 'body': 'first message'}],
+        'next_cursor': None,
+    }
 
 
 @pytest.mark.asyncio()
@@ -296,3 +266,13 @@ async def test_websocket_chat_admin(client, auth_header_admin):
 
         text = await ws.receive_text()
         assert text == 'test_bot: Hello from bot!'
+
+
+@pytest.mark.asyncio()
+async def test_websocket_unknown_bot_rejected(client, auth_header_admin):
+    websocket = client.websocket_connect('/ws/99', headers=auth_header_admin)
+    with pytest.raises(AssertionError):
+        await websocket.connect()
+
+    assert not manager.rooms
+    assert not any((await presence_dao.get_sessions()).values())
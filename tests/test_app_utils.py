@@ -0,0 +1,29 @@
+import pytest
+
+from app.app_utils import PasswordHasher, password_hasher, verify_password
+
+
+@pytest.mark.asyncio()
+async def test_password_hasher_runs_in_pool():
+    hasher = PasswordHasher(max_workers=1, max_pending=1)
+    try:
+        hashed = await hasher.hash('secret')
+
+        assert verify_password('secret', hashed)
+        assert await hasher.verify('secret', hashed)
+        assert hasher.wait_count == 2
+        assert hasher.pending == 0
+    finally:
+        hasher.shutdown()
+
+
+@pytest.mark.asyncio()
+async def test_login_rejected_when_saturated(client, mocker):
+    mocker.patch.object(password_hasher, 'pending', password_hasher.max_pending)
+
+    response = await client.post(
+        '/token', form=[('username', 'admin'), ('password', 'admin')]
+    )
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
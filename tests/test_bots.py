@@ -0,0 +1,286 @@
+import csv
+import io
+import json
+import sys
+
+import pytest
+
+from app.bot_utils import export_commands
+from app.cache import bot_list_cache, command_index
+from app.config import settings
+from app.db_models import Bot, Command
+from app.db_utils import create_db_session, reset_sequences
+from app.redis_utils import redis_dao
+from app.routers import bots
+from tests.conftest import new_test_db_session
+
+
+@pytest.fixture()
+def many_bots(session):
+    session.bulk_save_objects(
+        [Bot(id=i, name=f'bot {i}', author_id=1) for i in range(1, 6)]
+        + [Bot(id=6, name='Weather', author_id=1)]
+    )
+    session.commit()
+    reset_sequences(session)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('many_bots')
+async def test_get_bots_keyset_pages(client, auth_header_admin):
+    response = await client.get(
+        '/bots', headers=auth_header_admin, query_string={'limit': 4}
+    )
+    assert [bot['bot_id'] for bot in response.json()['bots']] == [1, 2, 3, 4]
+    assert response.json()['next_cursor'] == 4
+
+    response = await client.get(
+        '/bots', headers=auth_header_admin, query_string={'limit': 4, 'after': 4}
+    )
+    assert [bot['bot_id'] for bot in response.json()['bots']] == [5, 6]
+    assert response.json()['next_cursor'] is None
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('many_bots')
+async def test_get_bots_name_filter(client, auth_header_admin):
+    response = await client.get(
+        '/bots', headers=auth_header_admin, query_string={'name': 'weath'}
+    )
+
+    assert response.json()['bots'] == [
+        {'bot_id': 6, 'bot_name': 'Weather', 'author_username': 'admin'}
+    ]
+
+    for wildcard in ('%', '_', 'bot_1'):
+        response = await client.get(
+            '/bots', headers=auth_header_admin, query_string={'name': wildcard}
+        )
+        assert response.json()['bots'] == []
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_get_bots_cached_until_bot_added(client, auth_header_admin, session):
+    await client.get('/bots', headers=auth_header_admin)
+    session.add(Bot(id=2, name='hidden', author_id=1))
+    session.commit()
+    reset_sequences(session)
+
+    response = await client.get('/bots', headers=auth_header_admin)
+    assert len(response.json()['bots']) == 1
+
+    await client.post(
+        '/bots', headers=auth_header_admin, json={'name': 'bot', 'commands': []}
+    )
+    assert bot_list_cache.pages == {}
+
+    response = await client.get('/bots', headers=auth_header_admin)
+    assert len(response.json()['bots']) == 3
+
+
+@pytest.mark.asyncio()
+async def test_add_bot_duplicate_commands_rolled_back(client, auth_header_admin):
+    command = {'command': 'Hi', 'response': 'Welcome'}
+    response = await client.post(
+        '/bots',
+        headers=auth_header_admin,
+        json={'name': 'bot', 'commands': [command, command]},
+    )
+
+    assert response.status_code == 409
+    response = await client.get('/bots', headers=auth_header_admin)
+    assert response.json()['bots'] == []
+
+
+def ndjson(*bots):
+    return '\n'.join(json.dumps(bot) for bot in bots).encode()
+
+
+@pytest.mark.asyncio()
+async def test_import_bots_in_chunks(client, auth_header_admin, session, mocker):
+    mocker.patch('app.bot_utils.IMPORT_CHUNK_SIZE', 2)
+    commands = [{'command': f'q{i}', 'response': f'a{i}'} for i in range(3)]
+    body = ndjson(
+        {'name': 'faq', 'commands': commands},
+        {'name': 'empty', 'commands': []},
+        {'name': 'other', 'commands': commands[:1]},
+    )
+
+    response = await client.post(
+        '/bots/import', headers=auth_header_admin, data=body + b'\n'
+    )
+
+    assert response.json() == {'imported_bots': [1, 2, 3], 'imported_commands': 4}
+    assert session.query(Command).filter_by(bot_id=1).count() == 3
+    assert session.query(Command).filter_by(bot_id=3).count() == 1
+
+
+@pytest.mark.asyncio()
+async def test_import_bots_invalid_line(client, auth_header_admin, session):
+    body = ndjson({'name': 'faq', 'commands': []}, {'name': 'broken'})
+
+    response = await client.post('/bots/import', headers=auth_header_admin, data=body)
+
+    assert response.status_code == 422
+    assert response.json()['detail']['line'] == 2
+    assert session.query(Bot).count() == 0
+
+
+@pytest.mark.asyncio()
+async def test_import_bots_conflict_leaves_nothing(client, auth_header_admin, session):
+    duplicate = {'command': 'q', 'response': 'a'}
+    body = ndjson(
+        {'name': 'faq', 'commands': []},
+        {'name': 'broken', 'commands': [duplicate, duplicate]},
+    )
+
+    response = await client.post('/bots/import', headers=auth_header_admin, data=body)
+
+    assert response.status_code == 409
+    assert session.query(Bot).count() == 0
+
+
+@pytest.fixture()
+def faq_commands(bot, session):
+    session.bulk_save_objects(
+        [Command(message=f'q{i}', response=f'a, {i}', bot_id=1) for i in range(5)]
+    )
+    session.commit()
+
+
+async def collect_export(export_format):
+    async with create_db_session(new_test_db_session) as session:
+        return b''.join(
+            [chunk async for chunk in export_commands(session, 1, export_format)]
+        ).decode()
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize('async_db', [True, False])
+@pytest.mark.usefixtures('faq_commands')
+async def test_export_commands_ndjson(mocker, async_db):
+    mocker.patch.object(settings, 'async_db', async_db)
+    mocker.patch('app.bot_utils.EXPORT_CHUNK_SIZE', 2)
+
+    lines = [json.loads(line) for line in (await collect_export('ndjson')).splitlines()]
+
+    assert [line['command'] for line in lines] == [f'q{i}' for i in range(5)]
+    assert lines[0] == {
+        'command_id': 1,
+        'command': 'q0',
+        'response': 'a, 0',
+        'match_type': 'exact',
+    }
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('faq_commands')
+async def test_export_commands_csv():
+    rows = list(csv.reader(io.StringIO(await collect_export('csv'))))
+
+    assert rows[0] == ['command_id', 'command', 'response', 'match_type']
+    assert rows[1] == ['1', 'q0', 'a, 0', 'exact']
+    assert len(rows) == 6
+
+
+@pytest.mark.skipif(
+    sys.version_info >= (3, 11),
+    reason='starlette 0.13 StreamingResponse passes coroutines to asyncio.wait',
+)
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('faq_commands')
+async def test_export_commands_endpoint(client, auth_header_admin):
+    response = await client.get(
+        '/bots/1/commands/export',
+        headers=auth_header_admin,
+        query_string={'format': 'csv'},
+    )
+
+    assert response.headers['content-type'].startswith('text/csv')
+    assert len(response.text.splitlines()) == 6
+
+
+@pytest.mark.asyncio()
+async def test_export_unknown_bot(client, auth_header_admin):
+    response = await client.get('/bots/1/commands/export', headers=auth_header_admin)
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('faq_commands')
+async def test_get_bot_commands_pages(client, auth_header_admin):
+    response = await client.get(
+        '/bots/1/commands', headers=auth_header_admin, query_string={'limit': 3}
+    )
+    assert [c['command'] for c in response.json()['commands']] == ['q0', 'q1', 'q2']
+    assert response.json()['next_cursor'] == 3
+
+    response = await client.get(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        query_string={'limit': 3, 'cursor': 3},
+    )
+    assert [c['command'] for c in response.json()['commands']] == ['q3', 'q4']
+    assert response.json()['next_cursor'] is None
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('faq_commands')
+async def test_get_bot_commands_prefix(client, auth_header_admin, session):
+    session.add(Command(message='q_%', response='escaped', bot_id=1))
+    session.commit()
+
+    response = await client.get(
+        '/bots/1/commands', headers=auth_header_admin, query_string={'prefix': 'q_'}
+    )
+
+    assert [c['response'] for c in response.json()['commands']] == ['escaped']
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('faq_commands')
+async def test_get_bot_commands_etag(client, auth_header_admin, mocker):
+    list_commands = mocker.spy(bots, 'list_bot_commands')
+    load_version = mocker.spy(command_index, 'load_commands_version')
+    response = await client.get('/bots/1/commands', headers=auth_header_admin)
+    etag = response.headers['etag']
+
+    response = await client.get(
+        '/bots/1/commands', headers={**auth_header_admin, 'If-None-Match': etag}
+    )
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    assert list_commands.call_count == 1
+    assert load_version.call_count == 1
+
+    await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': 'new', 'response': 'fresh'},
+    )
+    response = await client.get(
+        '/bots/1/commands', headers={**auth_header_admin, 'If-None-Match': etag}
+    )
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert response.json()['commands'][-1]['command'] == 'new'
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('faq_commands')
+async def test_get_bot_commands_etag_survives_redis_flush(client, auth_header_admin):
+    response = await client.get('/bots/1/commands', headers=auth_header_admin)
+    etag = response.headers['etag']
+
+    await client.patch(
+        '/bots/1/commands/1', headers=auth_header_admin, json={'new_response': 'x'}
+    )
+    await redis_dao.redis.flushall()
+    response = await client.get(
+        '/bots/1/commands', headers={**auth_header_admin, 'If-None-Match': etag}
+    )
+
+    assert response.status_code == 200
+    assert response.json()['commands'][0]['response'] == 'x'
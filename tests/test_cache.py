@@ -0,0 +1,135 @@
+from time import time
+
+import pytest
+
+from app import authentication
+from app.cache import PrincipalCache, command_index, principal_cache
+from app.matching import CommandMatcher
+from app.pydantic_models import Principal
+from app.redis_utils import INVALIDATION_CHANNEL, redis_dao
+from tests.test_redis_utils import wait_for
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_command_index_loaded_once(client, auth_header_admin):
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        for _ in range(2):
+            await ws.send_text('Hello')
+            assert await ws.receive_text() == 'Admin: Hello'
+            assert await ws.receive_text() == 'test_bot: Hello from bot!'
+
+    assert command_index.misses == 1
+    assert command_index.hits == 1
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_command_index_patched_by_routes(client, auth_header_admin, session):
+    command_index.load(session, 1)
+
+    await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': 'Hi', 'response': 'Welcome'},
+    )
+    await client.patch(
+        '/bots/1/commands/1',
+        headers=auth_header_admin,
+        json={'new_response': 'Hi Again'},
+    )
+    assert command_index.get(1).match('Hello') == 'Hi Again'
+    assert command_index.get(1).match('Hi') == 'Welcome'
+
+    await client.delete('/bots/1/commands/1', headers=auth_header_admin)
+    assert command_index.get(1).match('Hello') is None
+    assert command_index.get(1).match('Hi') == 'Welcome'
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_command_index_invalidated_by_new_bot(client, auth_header_admin):
+    command_index.bots[2] = CommandMatcher()
+
+    await client.post(
+        '/bots',
+        headers=auth_header_admin,
+        json={'name': 'bot', 'commands': [{'command': 'Hi', 'response': 'Welcome'}]},
+    )
+
+    assert command_index.get(2) is None
+
+
+@pytest.mark.asyncio()
+async def test_command_index_evicted_by_other_worker(client):
+    command_index.bots[1] = CommandMatcher()
+    command_index.bots[2] = fresh = CommandMatcher()
+    command_index.commands_versions.update({1: ('bot', 1), 2: ('other', 1)})
+
+    await redis_dao.redis.publish(INVALIDATION_CHANNEL, '1:3')
+    await wait_for(lambda: 1 not in command_index.bots)
+
+    assert command_index.versions == {1: 3}
+    assert command_index.bots == {2: fresh}
+    assert command_index.commands_versions == {2: ('other', 1)}
+
+
+@pytest.mark.asyncio()
+async def test_command_index_evicts_on_any_foreign_version(client):
+    command_index.set_version(1, 5)
+    command_index.bots[1] = CommandMatcher()
+
+    await redis_dao.redis.publish(INVALIDATION_CHANNEL, '1:5')
+    await redis_dao.redis.publish(INVALIDATION_CHANNEL, '1:2')
+    await wait_for(lambda: 1 not in command_index.bots)
+
+    assert command_index.versions == {1: 2}
+    assert not command_index.published
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_command_route_publishes_version(client, auth_header_admin, session):
+    command_index.load(session, 1)
+
+    await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': 'Hi', 'response': 'Welcome'},
+    )
+    await wait_for(lambda: command_index.versions.get(1))
+
+    assert await redis_dao.redis.get('bot-version:1') == b'1'
+    assert command_index.get(1).match('Hello') == 'Hello from bot!'
+    assert command_index.get(1).match('Hi') == 'Welcome'
+
+
+@pytest.mark.asyncio()
+async def test_principal_cached_by_token(client, auth_header_admin, mocker):
+    get_user = mocker.spy(authentication, 'get_user')
+
+    for _ in range(2):
+        response = await client.get('/users/me', headers=auth_header_admin)
+        assert response.json() == {'user_id': 1, 'role': 'admin'}
+    assert get_user.call_count == 1
+
+    principal_cache.evict_user('admin')
+    await client.get('/users/me', headers=auth_header_admin)
+    assert get_user.call_count == 2
+
+
+def test_principal_cache_bounded_and_expiring():
+    cache = PrincipalCache(max_size=2, ttl=60)
+    principal = Principal(id=1, username='admin', role='admin', full_name='Admin')
+
+    cache.put('expired', {'exp': time() - 1}, principal)
+    assert cache.get('expired') is None
+
+    cache.put('first', {}, principal)
+    cache.put('second', {}, principal)
+    cache.get('first')
+    cache.put('third', {}, principal)
+
+    assert cache.get('second') is None
+    assert cache.get('first') == principal
+    assert cache.tokens_by_user == {'admin': {'first', 'third'}}
@@ -0,0 +1,185 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from app.config import settings
+from app.connection_manager import ConnectionManager
+from app.framing import pack, unpack
+
+
+class FakeWebSocket:
+    def __init__(self) -> None:
+        self.sent: List[str] = []
+        self.closed = False
+
+    async def accept(self, subprotocol=None) -> None:
+        pass
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed = True
+
+    async def send_text(self, message: str) -> None:
+        self.sent.append(message)
+
+    async def send_bytes(self, message: bytes) -> None:
+        self.sent.append(message)
+
+
+class StalledWebSocket(FakeWebSocket):
+    def __init__(self) -> None:
+        super().__init__()
+        self.unblock = asyncio.Event()
+
+    async def send_text(self, message: str) -> None:
+        await self.unblock.wait()
+        await super().send_text(message)
+
+    async def send_bytes(self, message: bytes) -> None:
+        await self.unblock.wait()
+        await super().send_bytes(message)
+
+
+def frame(body, sender='bot'):
+    return pack({'id': 1, 'ts': 1.0, 'sender': sender, 'body': body})
+
+
+async def wait_for(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio()
+async def test_broadcast_only_to_room():
+    manager = ConnectionManager()
+    first, second, other = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await manager.connect(first, 1, 1)
+    await manager.connect(second, 1, 1)
+    await manager.connect(other, 2, 1)
+
+    await manager.broadcast(1, 1, frame('hello'))
+    await wait_for(lambda: first.sent and second.sent)
+
+    assert first.sent == ['bot: hello']
+    assert second.sent == ['bot: hello']
+    assert other.sent == []
+    for websocket, user_id in ((first, 1), (second, 1), (other, 2)):
+        await manager.disconnect(websocket, user_id, 1)
+
+
+@pytest.mark.asyncio()
+async def test_disconnect_removes_empty_room():
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, 1, 1)
+
+    await manager.disconnect(websocket, 1, 1)
+    await manager.broadcast(1, 1, frame('hello'))
+
+    assert websocket.closed
+    assert websocket.sent == []
+    assert manager.rooms == {}
+
+
+@pytest.mark.asyncio()
+async def test_stalled_client_times_out_without_delaying_others(mocker):
+    mocker.patch.object(settings, 'ws_send_timeout', 0.05)
+    manager = ConnectionManager()
+    stalled, fast = StalledWebSocket(), FakeWebSocket()
+    await manager.connect(stalled, 1, 1)
+    await manager.connect(fast, 1, 1)
+
+    await manager.broadcast(1, 1, frame('hello'))
+    await wait_for(lambda: fast.sent)
+
+    assert fast.sent == ['bot: hello']
+    assert not stalled.closed
+
+    await wait_for(lambda: stalled.closed)
+    assert stalled.closed
+    assert list(manager.rooms[(1, 1)].values())[0].websocket is fast
+
+    await manager.disconnect(stalled, 1, 1)
+    await manager.disconnect(fast, 1, 1)
+    assert manager.rooms == {}
+
+
+@pytest.mark.asyncio()
+@pytest.mark.parametrize(
+    ('policy', 'delivered'),
+    [
+        ('drop_oldest', ['bot: m0', 'bot: m3', 'bot: m4']),
+        ('coalesce', ['bot: m0', '["bot: m1", "bot: m2", "bot: m3"]', 'bot: m4']),
+    ],
+)
+async def test_overflow_policies(mocker, policy, delivered):
+    mocker.patch.object(settings, 'ws_send_queue_size', 2)
+    mocker.patch.object(settings, 'ws_overflow_policy', policy)
+    manager = ConnectionManager()
+    websocket = StalledWebSocket()
+    await manager.connect(websocket, 1, 1)
+
+    await manager.broadcast(1, 1, frame('m0'))
+    await asyncio.sleep(0)
+    for i in range(1, 5):
+        await manager.broadcast(1, 1, frame(f'm{i}'))
+    websocket.unblock.set()
+    await wait_for(lambda: len(websocket.sent) == len(delivered))
+
+    assert websocket.sent == delivered
+    await manager.disconnect(websocket, 1, 1)
+
+
+@pytest.mark.asyncio()
+async def test_overflow_disconnects_slow_client(mocker):
+    mocker.patch.object(settings, 'ws_send_queue_size', 1)
+    mocker.patch.object(settings, 'ws_overflow_policy', 'disconnect')
+    manager = ConnectionManager()
+    websocket = StalledWebSocket()
+    await manager.connect(websocket, 1, 1)
+
+    for i in range(3):
+        await manager.broadcast(1, 1, frame(f'm{i}'))
+        await asyncio.sleep(0)
+    await wait_for(lambda: websocket.closed)
+
+    assert websocket.closed
+    assert manager.rooms == {}
+
+
+@pytest.mark.asyncio()
+async def test_failed_send_drops_connection(mocker):
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    mocker.patch.object(websocket, 'send_text', side_effect=RuntimeError('gone'))
+    await manager.connect(websocket, 1, 1)
+
+    await manager.broadcast(1, 1, frame('hello'))
+    await wait_for(lambda: websocket.closed)
+
+    assert websocket.closed
+    assert manager.rooms == {}
+
+
+@pytest.mark.asyncio()
+async def test_binary_connections_get_packed_records(mocker):
+    mocker.patch.object(settings, 'ws_send_queue_size', 1)
+    mocker.patch.object(settings, 'ws_overflow_policy', 'coalesce')
+    manager = ConnectionManager()
+    binary, text = StalledWebSocket(), FakeWebSocket()
+    await manager.connect(binary, 1, 1, 'chat.msgpack')
+    await manager.connect(text, 1, 1)
+
+    for i in range(3):
+        await manager.broadcast(1, 1, frame(f'm{i}'))
+        await asyncio.sleep(0)
+    binary.unblock.set()
+    await wait_for(lambda: len(binary.sent) == 2)
+
+    assert text.sent == ['bot: m0', 'bot: m1', 'bot: m2']
+    assert binary.sent[0] == frame('m0')
+    assert [r['body'] for r in unpack(binary.sent[1])] == ['m1', 'm2']
+    await manager.disconnect(binary, 1, 1)
+    await manager.disconnect(text, 1, 1)
@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app.config import settings
+from app.db_models import Base
+from app.db_utils import ASYNC_DRIVERS, SYNC_DRIVERS, engine_options, with_driver
+from app.migrations import migrate_db
+from tests.conftest import test_engine
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE "User" (id INTEGER NOT NULL, username VARCHAR NOT NULL, '
+    'hashed_password VARCHAR NOT NULL, full_name VARCHAR NOT NULL, '
+    'role VARCHAR(5) NOT NULL, PRIMARY KEY (id), UNIQUE (username))',
+    'CREATE TABLE "Bot" (id INTEGER NOT NULL, name VARCHAR NOT NULL, '
+    'author_id INTEGER NOT NULL, PRIMARY KEY (id), '
+    'FOREIGN KEY(author_id) REFERENCES "User" (id))',
+    'CREATE TABLE "Command" (id INTEGER NOT NULL, message VARCHAR NOT NULL, '
+    'response VARCHAR NOT NULL, bot_id INTEGER NOT NULL, PRIMARY KEY (id), '
+    'UNIQUE (message), FOREIGN KEY(bot_id) REFERENCES "Bot" (id))',
+    'INSERT INTO "Bot" VALUES (1, \'bot\', 1)',
+]
+
+
+@pytest.fixture()
+def sync_db(mocker):
+    mocker.patch.object(settings, 'async_db', False)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('sync_db', '_hello_message')
+async def test_threaded_session_routes(client, auth_header_admin):
+    response = await client.get('/bots/1/commands', headers=auth_header_admin)
+    assert response.json()['commands'][0]['command'] == 'Hello'
+
+    response = await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': 'Hello', 'response': 'Some response'},
+    )
+    assert response.status_code == 409
+
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        await ws.send_text('Hello')
+        assert await ws.receive_text() == 'Admin: Hello'
+        assert await ws.receive_text() == 'test_bot: Hello from bot!'
+
+
+def test_migrate_legacy_sqlite_schema(tmp_path):
+    legacy_engine = create_engine(f'sqlite:///{tmp_path / "legacy.db"}')
+    with legacy_engine.begin() as connection:
+        for ddl in LEGACY_SCHEMA:
+            connection.exec_driver_sql(ddl)
+        connection.exec_driver_sql(
+            "INSERT INTO \"Command\" VALUES (1, 'Hello', 'Hi', 1)"
+        )
+
+    Base.metadata.create_all(legacy_engine)
+    migrate_db(legacy_engine)
+
+    inspector = inspect(legacy_engine)
+    assert inspector.get_unique_constraints('Command') == []
+    assert {
+        'name': 'ux_command_bot_message',
+        'column_names': ['bot_id', 'message'],
+    }.items() <= (inspector.get_indexes('Command')[0].items())
+    with legacy_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO \"Command\" (message, response, bot_id) VALUES ('Hello', 'Hey', 2)"
+        )
+        rows = connection.exec_driver_sql(
+            'SELECT message, match_type, bot_id FROM "Command" ORDER BY id'
+        ).all()
+        history_size = connection.exec_driver_sql(
+            'SELECT history_size FROM "Bot"'
+        ).all()
+
+    assert rows == [('Hello', 'EXACT', 1), ('Hello', 'EXACT', 2)]
+    assert history_size == [(None,)]
+
+
+@pytest.mark.skipif(
+    test_engine.dialect.name != 'sqlite', reason='SQLite specific pragmas'
+)
+def test_sqlite_pragmas_applied(session):
+    assert session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+    assert session.execute(text('PRAGMA synchronous')).scalar() == 1
+
+
+def test_postgres_engine_options():
+    sync_url = with_driver('postgresql://app@db/app', SYNC_DRIVERS)
+    async_url = with_driver('postgresql://app@db/app', ASYNC_DRIVERS)
+
+    sync_options = engine_options(sync_url, is_async=False)
+    async_options = engine_options(async_url, is_async=True)
+
+    assert sync_url.drivername == 'postgresql+psycopg2'
+    assert async_url.drivername == 'postgresql+asyncpg'
+    assert sync_options['pool_pre_ping'] is True
+    assert sync_options['connect_args'] == {'options': '-c statement_timeout=30000'}
+    assert async_options['connect_args'] == {
+        'server_settings': {'statement_timeout': '30000'}
+    }
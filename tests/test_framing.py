@@ -0,0 +1,175 @@
+import json
+
+import pytest
+from async_asgi_testclient import TestClient
+
+from app.config import MAX_BATCH_SIZE
+from app.connection_manager import manager
+from app.db_models import MatchTypeEnum
+from app.framing import (
+    coalesce,
+    pack,
+    pack_array,
+    parse_binary,
+    parse_text,
+    unpack,
+    unpack_batch,
+    unpack_record,
+)
+from app.matching import CommandMatcher
+from app.redis_utils import redis_dao
+
+
+def with_subprotocols(app):
+    async def asgi(scope, receive, send):
+        if scope['type'] == 'websocket':
+            headers = dict(scope['headers'])
+            protocols = headers.get(b'sec-websocket-protocol', b'').decode()
+            scope['subprotocols'] = [p.strip() for p in protocols.split(',') if p]
+        await app(scope, receive, send)
+
+    return asgi
+
+
+def test_unpack_record_reads_legacy_json():
+    record = {'id': 1, 'ts': 1.0, 'sender': 'admin', 'body': 'hi'}
+
+    assert unpack_record(b'{"id":1,"ts":1.0,"sender":"admin","body":"hi"}') == record
+    assert unpack_record(pack(record)) == record
+    assert unpack_record(b'admin: hi') == {**record, 'id': 0, 'ts': 0.0}
+    assert unpack_record(b'{admin}: hi')['sender'] == '{admin}'
+
+
+def test_unpack_batch_pairs_messages_with_replies():
+    matcher = CommandMatcher([('Hello', MatchTypeEnum.EXACT, 'Hi!')])
+
+    assert unpack_batch(['Hello', 'Bye'], 'Admin', 'bot', matcher) == [
+        ('Admin', 'Hello'),
+        ('bot', 'Hi!'),
+        ('Admin', 'Bye'),
+    ]
+    assert unpack_batch(['Hello'], 'Admin', 'bot') == [('Admin', 'Hello')]
+
+
+@pytest.mark.parametrize('size', [0, 3, 20, 70000])
+def test_pack_array_matches_msgpack(size):
+    assert pack_array([pack(i) for i in range(size)]) == pack(list(range(size)))
+
+
+@pytest.mark.parametrize(
+    ('frame', 'batch'),
+    [
+        ('Hello', ['Hello']),
+        ('["Hello", "Bye"]', ['Hello', 'Bye']),
+        ('[not json', ['[not json']),
+        ('[1, 2]', ['[1, 2]']),
+        ('[]', []),
+    ],
+)
+def test_parse_text(frame, batch):
+    assert parse_text(frame) == batch
+
+
+def test_parse_binary():
+    assert parse_binary(pack('Hello')) == ['Hello']
+    assert parse_binary(pack(['Hello', 1, 'Bye'])) == ['Hello', 'Bye']
+
+
+def test_batch_size_capped():
+    batch = ['Hello'] * (MAX_BATCH_SIZE + 1)
+
+    with pytest.raises(ValueError):
+        parse_text(json.dumps(batch))
+    with pytest.raises(ValueError):
+        parse_binary(pack(batch))
+    assert len(parse_text(json.dumps(batch[1:]))) == MAX_BATCH_SIZE
+
+
+def test_coalesce_text_frames_into_json_array():
+    frames = ['bot: a', '["bot: b", "bot: c"]', '[bot]: d']
+
+    assert json.loads(coalesce(frames)) == ['bot: a', 'bot: b', 'bot: c', '[bot]: d']
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_text_batch_frame(client, auth_header_admin):
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        await ws.send_text('["Hello", "Unknown", "Hello"]')
+        frame = await ws.receive_text()
+        history = await redis_dao.get_history_from_redis(1, 1)
+
+    assert json.loads(frame) == [
+        'Admin: Hello',
+        'test_bot: Hello from bot!',
+        'Admin: Unknown',
+        'Admin: Hello',
+        'test_bot: Hello from bot!',
+    ]
+    assert [r['body'] for r in history] == [
+        'Hello',
+        'Hello from bot!',
+        'Unknown',
+        'Hello',
+        'Hello from bot!',
+    ]
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_msgpack_subprotocol(test_app, auth_header_admin):
+    headers = {**auth_header_admin, 'Sec-WebSocket-Protocol': 'chat.msgpack'}
+
+    async with TestClient(with_subprotocols(test_app)) as client:
+        async with client.websocket_connect('/ws/1', headers=headers) as ws:
+            await ws.send_bytes(pack('Hello'))
+            frames = [unpack(await ws.receive_bytes()) for _ in range(2)]
+        stored = await redis_dao.redis.lrange('hist:1:1', 0, -1)
+
+    assert [(f['sender'], f['body']) for f in frames] == [
+        ('Admin', 'Hello'),
+        ('test_bot', 'Hello from bot!'),
+    ]
+    assert frames[0]['id'] < frames[1]['id']
+    assert [unpack(record) for record in stored] == frames
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_msgpack_batch_frame(test_app, auth_header_admin):
+    headers = {**auth_header_admin, 'Sec-WebSocket-Protocol': 'chat.msgpack'}
+
+    async with TestClient(with_subprotocols(test_app)) as client:
+        async with client.websocket_connect('/ws/1', headers=headers) as ws:
+            await ws.send_bytes(pack(['Hello', 'Hello']))
+            records = unpack(await ws.receive_bytes())
+
+    assert [(r['sender'], r['body']) for r in records] == [
+        ('Admin', 'Hello'),
+        ('test_bot', 'Hello from bot!'),
+    ] * 2
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_binary_frame_on_text_socket_closes(client, auth_header_admin):
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        await ws.send_bytes(pack('Hello'))
+        message = await ws._receive()
+
+    assert message == {'type': 'websocket.close', 'code': 1003}
+    assert not manager.rooms
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_malformed_msgpack_frame_closes(test_app, auth_header_admin):
+    headers = {**auth_header_admin, 'Sec-WebSocket-Protocol': 'chat.msgpack'}
+
+    async with TestClient(with_subprotocols(test_app)) as client:
+        async with client.websocket_connect('/ws/1', headers=headers) as ws:
+            await ws.send_bytes(pack('Hello') + b'\xc1')
+            message = await ws._receive()
+
+    assert message == {'type': 'websocket.close', 'code': 1007}
+    assert not manager.rooms
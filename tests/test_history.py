@@ -0,0 +1,132 @@
+from time import time
+
+import pytest
+
+from app.config import settings
+from app.db_models import Bot, Message
+from app.db_utils import prune_messages, save_messages
+from app.migrations import HISTORY_MIGRATION, migrate_history
+from app.redis_utils import redis_dao
+from app.retention import message_pruner
+from tests.test_redis_utils import wait_for
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_long_history')
+async def test_history_pages_from_redis_to_db(client, auth_header_admin):
+    response = await client.get(
+        '/bots/1/messages/1', headers=auth_header_admin, query_string={'limit': 2}
+    )
+    assert [m['id'] for m in response.json()['history']] == [4, 5]
+    assert response.json()['next_cursor'] == 4
+
+    response = await client.get(
+        '/bots/1/messages/1',
+        headers=auth_header_admin,
+        query_string={'limit': 2, 'before': 4},
+    )
+    assert [m['id'] for m in response.json()['history']] == [2, 3]
+    assert response.json()['next_cursor'] == 2
+
+    response = await client.get(
+        '/bots/1/messages/1',
+        headers=auth_header_admin,
+        query_string={'limit': 2, 'before': 2},
+    )
+    assert [m['id'] for m in response.json()['history']] == [1]
+    assert response.json()['next_cursor'] is None
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_long_history')
+async def test_history_page_spans_redis_and_db(client, auth_header_admin):
+    response = await client.get(
+        '/bots/1/messages/1', headers=auth_header_admin, query_string={'limit': 4}
+    )
+
+    assert [m['body'] for m in response.json()['history']] == ['2', '3', '4', '5']
+
+
+@pytest.mark.asyncio()
+async def test_evicted_messages_moved_to_db(client, auth_header_admin, session):
+    response = await client.post(
+        '/bots',
+        headers=auth_header_admin,
+        json={'name': 'bot', 'commands': [], 'history_size': 2},
+    )
+    bot_id = response.json()['bot_id']
+
+    async with client.websocket_connect(
+        f'/ws/{bot_id}', headers=auth_header_admin
+    ) as ws:
+        for message in ('one', 'two', 'three'):
+            await ws.send_text(message)
+            assert await ws.receive_text() == f'Admin: {message}'
+
+    query = session.query(Message.body).filter_by(user_id=1, bot_id=bot_id)
+    await wait_for(query.count)
+    stored = query.all()
+    response = await client.get(f'/bots/{bot_id}/messages/1', headers=auth_header_admin)
+
+    assert stored == [('one',)]
+    assert [m['body'] for m in response.json()['history']] == ['one', 'two', 'three']
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_legacy_history_entries_read_and_migrated(client, auth_header_admin):
+    await redis_dao.redis.delete(HISTORY_MIGRATION)
+    await redis_dao.redis.rpush('hist:1:1', 'admin: old: one', 'test_bot: two')
+    await redis_dao.publish_to_redis(1, 1, [('admin', 'new')])
+
+    response = await client.get('/bots/1/messages/1', headers=auth_header_admin)
+    assert [(m['sender'], m['body']) for m in response.json()['history']] == [
+        ('admin', 'old: one'),
+        ('test_bot', 'two'),
+        ('admin', 'new'),
+    ]
+
+    assert await migrate_history(redis_dao.redis) == 2
+    history = await redis_dao.get_history_from_redis(1, 1)
+    assert [m['id'] for m in history][:2] == [1, 2]
+    assert history[2]['id'] > 2
+    assert await migrate_history(redis_dao.redis) == 0
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_evicted_legacy_entries_saved(client, session):
+    await redis_dao.redis.rpush('hist:1:1', 'admin: old', 'test_bot: older')
+
+    evicted = await redis_dao.publish_to_redis(1, 1, [('admin', 'new')], 1)
+    save_messages(session, 1, 1, evicted)
+
+    assert [(m.id, m.body) for m in session.query(Message).order_by(Message.id)] == [
+        (1, 'old'),
+        (2, 'older'),
+    ]
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_expired_messages_pruned(session, mocker):
+    session.query(Bot).filter_by(id=1).update({'message_retention_days': 1})
+    session.add(Bot(id=2, name='kept', author_id=1))
+    old, now = time() - 2 * 86400, time()
+    session.bulk_insert_mappings(
+        Message,
+        [
+            {'id': 1, 'user_id': 1, 'bot_id': 1, 'ts': old, 'sender': 'a', 'body': ''},
+            {'id': 2, 'user_id': 1, 'bot_id': 1, 'ts': now, 'sender': 'a', 'body': ''},
+            {'id': 3, 'user_id': 1, 'bot_id': 2, 'ts': old, 'sender': 'a', 'body': ''},
+        ],
+    )
+    session.commit()
+
+    assert await message_pruner.prune() == 1
+
+    mocker.patch.object(settings, 'message_retention_days', 30)
+    assert prune_messages(session, now) == 0
+    mocker.patch.object(settings, 'message_retention_days', 1)
+    assert prune_messages(session, now) == 1
+    assert [m.id for m in session.query(Message)] == [2]
@@ -0,0 +1,184 @@
+import re
+
+import pytest
+
+from app.db_models import Command, MatchTypeEnum
+from app.matching import CommandMatcher, required_literal
+
+
+@pytest.fixture()
+def matcher():
+    return CommandMatcher(
+        [
+            ('Hello', MatchTypeEnum.EXACT, 'exact'),
+            ('hi there', MatchTypeEnum.IGNORE_CASE, 'ignore case'),
+            ('/help', MatchTypeEnum.PREFIX, 'help'),
+            ('/help me', MatchTypeEnum.PREFIX, 'help me'),
+            ('price', MatchTypeEnum.KEYWORD, 'keyword'),
+            ('opening hours', MatchTypeEnum.KEYWORD, 'phrase'),
+            (r'order #\d+', MatchTypeEnum.REGEX, 'regex'),
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    ('message', 'response'),
+    [
+        ('Hello', 'exact'),
+        ('hello', None),
+        ('HI THERE', 'ignore case'),
+        ('/HELP now', 'help'),
+        ('/help me please', 'help me'),
+        ('What is the Price?', 'keyword'),
+        ('pricey', None),
+        ('Your Opening Hours?', 'phrase'),
+        ('where is order #42', 'regex'),
+        ('order #x', None),
+    ],
+)
+def test_match(matcher, message, response):
+    assert matcher.match(message) == response
+
+
+@pytest.mark.parametrize(
+    ('pattern', 'literal'),
+    [
+        (r'order #\d+', 'order #'),
+        (r'(?i)Hello (?:World)!', 'hello world!'),
+        (r'a(?i:bcd)ef', 'ef'),
+        (r'(?i)straße', 'stra'),
+        (r'\d+|x', ''),
+    ],
+)
+def test_required_literal(pattern, literal):
+    assert required_literal(re.compile(pattern)) == literal
+
+
+def test_unparsable_regex_is_not_prefiltered(mocker):
+    mocker.patch('app.matching.literal_runs', side_effect=AttributeError)
+    matcher = CommandMatcher([(r'order #\d+', MatchTypeEnum.REGEX, 'regex')])
+
+    assert required_literal(re.compile('order')) == ''
+    assert matcher.match('where is order #42') == 'regex'
+
+
+def test_regex_prefilter_keeps_semantics():
+    matcher = CommandMatcher(
+        [
+            ('(?i)hello', MatchTypeEnum.REGEX, 'hello'),
+            (r'\bok\b', MatchTypeEnum.REGEX, 'ok'),
+            (r'\d{3}', MatchTypeEnum.REGEX, 'digits'),
+            ('(broken', MatchTypeEnum.REGEX, 'never'),
+            ('Exact', MatchTypeEnum.EXACT, 'exact'),
+            ('ship it now', MatchTypeEnum.KEYWORD, 'phrase'),
+            ('(?i)sun', MatchTypeEnum.REGEX, 'sun'),
+        ]
+    )
+
+    assert matcher.match('Exact') == 'exact'
+    assert matcher.match('say HELLO ok') == 'hello'
+    assert matcher.match('ok then, HELLO') == 'ok'
+    assert matcher.match('KELLY') is None
+    assert matcher.match('ſUN') == 'sun'
+    assert matcher.match('call 555') == 'digits'
+    assert matcher.match('Ship it now!') == 'phrase'
+    assert matcher.match('reship it nowhere') is None
+
+
+def test_recompiled_after_change(matcher):
+    matcher.set_command('bye', MatchTypeEnum.KEYWORD, 'bye')
+    matcher.remove_command('Hello')
+
+    assert matcher.match('ok bye') == 'bye'
+    assert matcher.match('Hello') is None
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_get_bot_commands(client, auth_header_admin):
+    response = await client.get('/bots/1/commands', headers=auth_header_admin)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        'bot_name': 'test_bot',
+        'commands': [
+            {
+                'command_id': 1,
+                'command': 'Hello',
+                'response': 'Hello from bot!',
+                'match_type': 'exact',
+            }
+        ],
+        'next_cursor': None,
+    }
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_add_bot_command(client, auth_header_admin, session):
+    response = await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': 'Hi', 'response': 'Welcome'},
+    )
+
+    added_cmd_resp = (
+        session.query(Command).filter_by(bot_id=1, message='Hi').one().response
+    )
+
+    assert added_cmd_resp == 'Welcome'
+    assert response.status_code == 200
+    assert response.json() == {
+        'bot_name': 'test_bot',
+        'added_command': {
+            'command': 'Hi',
+            'response': 'Welcome',
+            'match_type': 'exact',
+        },
+        'author_username': 'admin',
+    }
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_add_regex_command(client, auth_header_admin):
+    response = await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': '(a|b', 'response': 'ab', 'match_type': 'regex'},
+    )
+    assert response.status_code == 422
+
+    response = await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': '(a|b)c', 'response': 'ab', 'match_type': 'regex'},
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_add_regex_command_with_global_flags(client, auth_header_admin):
+    response = await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': '(?i)hello', 'response': 'hi', 'match_type': 'regex'},
+    )
+
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_websocket_pattern_reply(client, auth_header_admin):
+    await client.post(
+        '/bots/1/commands',
+        headers=auth_header_admin,
+        json={'command': 'weather', 'response': 'Sunny', 'match_type': 'keyword'},
+    )
+
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        await ws.send_text('How is the weather?')
+        assert await ws.receive_text() == 'Admin: How is the weather?'
+        assert await ws.receive_text() == 'test_bot: Sunny'
@@ -0,0 +1,100 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from app.connection_manager import manager
+from app.db_utils import ThreadedSession
+from tests.conftest import TestingSessionLocal
+from tests.test_connection_manager import FakeWebSocket
+from tests.test_redis_utils import wait_for
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_metrics_endpoint(client, auth_header_admin):
+    requests_before = sample(
+        'http_request_duration_seconds_count', method='GET', route='/bots'
+    )
+    queries_before = sample('db_query_duration_seconds_count')
+
+    await client.get('/bots', headers=auth_header_admin)
+    response = await client.get('/metrics')
+
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds_bucket' in response.text
+    assert (
+        sample('http_request_duration_seconds_count', method='GET', route='/bots')
+        == requests_before + 1
+    )
+    assert sample('db_query_duration_seconds_count') > queries_before
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_chat_metrics(client, auth_header_admin):
+    messages_in = sample('chat_messages_total', direction='in')
+    messages_out = sample('chat_messages_total', direction='out')
+    publishes = sample(
+        'redis_command_duration_seconds_count', method='publish_to_redis'
+    )
+
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        assert sample('websocket_connections', bot_id='1') == 1
+        await ws.send_text('Hello')
+        await ws.receive_text()
+        await ws.receive_text()
+
+    assert sample('chat_messages_total', direction='in') == messages_in + 1
+    assert sample('chat_messages_total', direction='out') == messages_out + 2
+    await wait_for(
+        lambda: sample(
+            'redis_command_duration_seconds_count', method='publish_to_redis'
+        )
+        > publishes
+    )
+    assert (
+        sample('redis_command_duration_seconds_count', method='publish_to_redis')
+        == publishes + 1
+    )
+
+
+@pytest.mark.asyncio()
+async def test_db_executor_pending_gauge():
+    pending = sample('db_executor_pending')
+    session = ThreadedSession(TestingSessionLocal())
+
+    assert await session.run_sync(lambda _: sample('db_executor_pending')) == (
+        pending + 1
+    )
+    assert sample('db_executor_pending') == pending
+    await session.close()
+
+
+@pytest.mark.asyncio()
+async def test_websocket_gauge_per_bot():
+    websocket, other = FakeWebSocket(), FakeWebSocket()
+    await manager.connect(websocket, 1, 7)
+    await manager.connect(other, 2, 7)
+
+    assert sample('websocket_connections', bot_id='7') == 2
+
+    await manager.disconnect(websocket, 1, 7)
+    assert sample('websocket_connections', bot_id='7') == 1
+    await manager.disconnect(other, 2, 7)
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_command_index_metrics(client, auth_header_admin):
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        for _ in range(2):
+            await ws.send_text('Hello')
+            await ws.receive_text()
+            await ws.receive_text()
+
+    assert sample('command_index_lookups_total', result='miss') == 1
+    assert sample('command_index_lookups_total', result='hit') == 1
+    assert sample('command_index_bots') == 1
@@ -0,0 +1,59 @@
+from time import time
+
+import pytest
+
+from app.connection_manager import ConnectionManager
+from app.presence import PRESENCE_NODES, presence_dao
+from app.redis_utils import NODE_ID, redis_dao
+from tests.test_connection_manager import FakeWebSocket
+from tests.test_redis_utils import wait_for
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_sessions_across_nodes(client, auth_header_admin):
+    await redis_dao.redis.zadd(PRESENCE_NODES, time(), 'node-b')
+    await redis_dao.redis.hmset_dict('presence:node-b', {'2:1': 2, '3:5': 1})
+    await redis_dao.redis.zadd(PRESENCE_NODES, time() - 3600, 'node-dead')
+    await redis_dao.redis.hmset_dict('presence:node-dead', {'4:1': 7})
+
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        await ws.send_text('Hi')
+        await ws.receive_text()
+        response = await client.get('/sessions', headers=auth_header_admin)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        'total': 4,
+        'bots': {'1': 3, '5': 1},
+        'nodes': {NODE_ID: 1, 'node-b': 3},
+    }
+    assert await redis_dao.redis.zscore(PRESENCE_NODES, 'node-dead') is None
+
+    await wait_for(lambda: redis_dao.subscriptions == {})
+    response = await client.get('/sessions', headers=auth_header_admin)
+    assert response.json()['nodes'] == {NODE_ID: 0, 'node-b': 3}
+
+
+@pytest.mark.asyncio()
+async def test_sessions_require_admin(client, auth_header_user):
+    response = await client.get('/sessions', headers=auth_header_user)
+
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio()
+async def test_heartbeat_rewrites_presence_from_local_rooms():
+    manager = ConnectionManager()
+    await manager.connect(FakeWebSocket(), 1, 1)
+    await manager.connect(FakeWebSocket(), 1, 1)
+    await manager.connect(FakeWebSocket(), 2, 3)
+    await redis_dao.redis.hset(f'presence:{NODE_ID}', '9:9', 5)
+
+    await presence_dao.write_presence(manager)
+
+    assert await presence_dao.get_sessions() == {NODE_ID: {'1:1': 2, '2:3': 1}}
+    assert 0 < await redis_dao.redis.ttl(f'presence:{NODE_ID}') <= 30
+
+    await presence_dao.clear_presence()
+    assert await presence_dao.get_sessions() == {}
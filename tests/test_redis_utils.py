@@ -0,0 +1,67 @@
+import pytest
+
+from app.connection_manager import ConnectionManager
+from app.redis_utils import IdGenerator, redis_dao
+from tests.test_connection_manager import FakeWebSocket, wait_for
+
+
+@pytest.mark.asyncio()
+async def test_single_reader_for_all_rooms():
+    manager = ConnectionManager()
+    first, second = FakeWebSocket(), FakeWebSocket()
+    await manager.connect(first, 1, 1)
+    await manager.connect(second, 2, 1)
+
+    await redis_dao.subscribe(manager, 1, 1)
+    reader_task = redis_dao.reader_task
+    await redis_dao.subscribe(manager, 2, 1)
+
+    await redis_dao.publish_to_redis(1, 1, [('admin', 'hi')])
+    await redis_dao.publish_to_redis(2, 1, [('user', 'hello')])
+    await wait_for(lambda: first.sent and second.sent)
+
+    assert redis_dao.reader_task is reader_task
+    assert first.sent == ['admin: hi']
+    assert second.sent == ['user: hello']
+
+
+@pytest.mark.asyncio()
+async def test_unsubscribe_after_last_socket_leaves():
+    manager = ConnectionManager()
+    await redis_dao.subscribe(manager, 1, 1)
+    await redis_dao.subscribe(manager, 1, 1)
+
+    await redis_dao.unsubscribe(1, 1)
+    assert redis_dao.subscriptions == {'ch:1:1': 1}
+    assert list(redis_dao.receiver.channels) == [b'ch:1:1']
+
+    await redis_dao.unsubscribe(1, 1)
+    assert redis_dao.subscriptions == {}
+    assert list(redis_dao.receiver.channels) == []
+
+
+@pytest.mark.asyncio()
+async def test_publish_batch_trims_history():
+    evicted = []
+    for i in range(2):
+        evicted += await redis_dao.publish_to_redis(
+            1, 1, [('user', f'q{i}'), ('bot', f'a{i}')], history_size=3
+        )
+
+    history = await redis_dao.get_history_from_redis(1, 1)
+
+    assert [(r['sender'], r['body']) for r in evicted] == [('user', 'q0')]
+    assert [(r['sender'], r['body']) for r in history] == [
+        ('bot', 'a0'),
+        ('user', 'q1'),
+        ('bot', 'a1'),
+    ]
+    assert evicted[0]['id'] < history[0]['id'] < history[-1]['id']
+
+
+@pytest.mark.asyncio()
+async def test_worker_ids_claimed_from_redis(client):
+    assert IdGenerator.worker_id == 1
+
+    assert await redis_dao.claim_worker_id() == 2
+    assert (IdGenerator.generate_id() >> 12) & 0x3FF == 2
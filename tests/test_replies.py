@@ -0,0 +1,216 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.config import settings
+from app.connection_manager import ConnectionManager
+from app.framing import pack, unpack
+from app.redis_utils import redis_dao
+from app.replies import ReplyWorker
+from app.reply_stream import reply_stream_dao
+from tests.conftest import new_test_db_session
+from tests.test_connection_manager import FakeWebSocket
+from tests.test_redis_utils import wait_for
+
+
+def job(*messages, bot_id=b'1'):
+    return {
+        b'user_id': b'1',
+        b'bot_id': bot_id,
+        b'bot_name': b'test_bot',
+        b'history_size': b'10',
+        b'messages': pack(list(messages)),
+    }
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_worker_publishes_replies_and_acks(mocker):
+    ack = mocker.patch.object(reply_stream_dao, 'ack_replies', new_callable=AsyncMock)
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, 1, 1)
+    await redis_dao.subscribe(manager, 1, 1)
+
+    worker = ReplyWorker('test', new_test_db_session)
+    await worker.process(
+        [
+            (b'1-0', job('Hello')),
+            (b'2-0', job('Unknown')),
+            (b'3-0', job('Hello', bot_id=b'x')),
+        ]
+    )
+    await wait_for(lambda: websocket.sent)
+
+    assert websocket.sent == ['test_bot: Hello from bot!']
+    ack.assert_awaited_once_with([b'1-0', b'2-0', b'3-0'])
+    history = await redis_dao.get_history_from_redis(1, 1)
+    assert [(r['sender'], r['body']) for r in history] == [
+        ('test_bot', 'Hello from bot!')
+    ]
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_websocket_enqueues_reply(client, auth_header_admin, mocker):
+    mocker.patch.object(settings, 'reply_queue', True)
+    xadd = mocker.patch.object(redis_dao.redis, 'xadd', new_callable=AsyncMock)
+
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        await ws.send_text('Hello')
+        assert await ws.receive_text() == 'Admin: Hello'
+        await wait_for(lambda: xadd.await_count)
+
+    xadd.assert_awaited_once_with(
+        'replies',
+        {
+            'user_id': 1,
+            'bot_id': 1,
+            'bot_name': 'test_bot',
+            'history_size': 10,
+            'messages': pack(['Hello']),
+        },
+        max_len=settings.reply_stream_max_len,
+    )
+
+
+@pytest.mark.asyncio()
+async def test_worker_replays_pending_before_new_entries(mocker):
+    read = mocker.patch.object(
+        reply_stream_dao,
+        'read_replies',
+        new_callable=AsyncMock,
+        side_effect=[[(b'1-0', job('Hello'))], [], [], asyncio.CancelledError],
+    )
+    process = mocker.patch.object(ReplyWorker, 'process', new_callable=AsyncMock)
+
+    with pytest.raises(asyncio.CancelledError):
+        await ReplyWorker('test').run()
+
+    assert [c.args for c in read.await_args_list] == [
+        ('test', '0'),
+        ('test', '0'),
+        ('test', '>'),
+        ('test', '>'),
+    ]
+    assert process.await_count == 3
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_worker_batches_replies(mocker):
+    mocker.patch.object(reply_stream_dao, 'ack_replies', new_callable=AsyncMock)
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, 1, 1, 'chat.msgpack')
+    await redis_dao.subscribe(manager, 1, 1)
+
+    await ReplyWorker('test', new_test_db_session).process(
+        [(b'1-0', job('Hello', 'Unknown', 'Hello'))]
+    )
+    await wait_for(lambda: websocket.sent)
+
+    [frame] = websocket.sent
+    assert [r['body'] for r in unpack(frame)] == ['Hello from bot!'] * 2
+    await manager.disconnect(websocket, 1, 1)
+
+
+@pytest.mark.asyncio()
+async def test_claim_replies_of_idle_entries(mocker):
+    mocker.patch.object(
+        redis_dao.redis,
+        'xpending',
+        new_callable=AsyncMock,
+        return_value=[
+            [b'1-0', b'dead', 120_000, 1],
+            [b'2-0', b'busy', 10, 1],
+            [b'3-0', b'test', 120_000, 2],
+            [b'4-0', b'dead', 90_000, 3],
+            [b'5-0', b'dead', 90_000, 5],
+        ],
+    )
+    xclaim = mocker.patch.object(
+        redis_dao.redis,
+        'xclaim',
+        new_callable=AsyncMock,
+        return_value=[(b'1-0', job('Hello')), (b'4-0', job('Hello'))],
+    )
+    ack = mocker.patch.object(reply_stream_dao, 'ack_replies', new_callable=AsyncMock)
+
+    claimed = await reply_stream_dao.claim_replies('test')
+
+    assert [entry_id for entry_id, _ in claimed] == [b'1-0', b'4-0']
+    xclaim.assert_awaited_once_with(
+        'replies', 'reply-workers', 'test', 60_000, b'1-0', b'3-0', b'4-0'
+    )
+    ack.assert_awaited_once_with([b'5-0'])
+
+
+@pytest.mark.asyncio()
+async def test_worker_leaves_failed_replies_pending(mocker):
+    ack = mocker.patch.object(reply_stream_dao, 'ack_replies', new_callable=AsyncMock)
+    mocker.patch.object(
+        ReplyWorker,
+        'handle',
+        new_callable=AsyncMock,
+        side_effect=[RuntimeError('db is down'), None],
+    )
+
+    await ReplyWorker('test').process([(b'1-0', job('Hello')), (b'2-0', job('Hello'))])
+
+    ack.assert_awaited_once_with([b'2-0'])
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_worker_retries_claimed_reply(mocker):
+    mocker.patch.object(
+        redis_dao.redis,
+        'xpending',
+        new_callable=AsyncMock,
+        return_value=[[b'1-0', b'test', 120_000, 1]],
+    )
+    mocker.patch.object(
+        redis_dao.redis,
+        'xclaim',
+        new_callable=AsyncMock,
+        return_value=[(b'1-0', job('Hello'))],
+    )
+    xack = mocker.patch.object(redis_dao.redis, 'xack', new_callable=AsyncMock)
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, 1, 1)
+    await redis_dao.subscribe(manager, 1, 1)
+
+    worker = ReplyWorker('test', new_test_db_session)
+    await worker.process(await reply_stream_dao.claim_replies('test'))
+    await wait_for(lambda: websocket.sent)
+
+    assert websocket.sent == ['test_bot: Hello from bot!']
+    xack.assert_awaited_once_with('replies', 'reply-workers', b'1-0')
+    await manager.disconnect(websocket, 1, 1)
+
+
+@pytest.mark.asyncio()
+async def test_worker_claims_stale_entries_periodically(mocker):
+    mocker.patch.object(settings, 'reply_claim_interval', 0)
+    mocker.patch.object(
+        reply_stream_dao,
+        'read_replies',
+        new_callable=AsyncMock,
+        return_value=[],
+    )
+    claim = mocker.patch.object(
+        reply_stream_dao,
+        'claim_replies',
+        new_callable=AsyncMock,
+        side_effect=[[(b'1-0', job('Hello'))], asyncio.CancelledError],
+    )
+    process = mocker.patch.object(ReplyWorker, 'process', new_callable=AsyncMock)
+
+    with pytest.raises(asyncio.CancelledError):
+        await ReplyWorker('test').run()
+
+    assert [c.args for c in claim.await_args_list] == [('test',), ('test',)]
+    assert process.await_args_list[1].args == ([(b'1-0', job('Hello'))],)
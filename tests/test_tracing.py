@@ -0,0 +1,114 @@
+import json
+from threading import get_ident
+
+import pytest
+
+from app.tracing import NULL_CONTEXT, Tracer, span, tracer
+from tests.test_redis_utils import wait_for
+
+
+def read_traces(path):
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+@pytest.fixture()
+def trace_log(mocker, tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    mocker.patch.object(tracer, 'log_path', str(path))
+    mocker.patch.object(tracer, 'slow_ms', 0)
+    return path
+
+
+def test_disabled_tracing_is_a_no_op():
+    disabled = Tracer(0.0, None, 0, 'unused.jsonl')
+
+    assert disabled.trace('request') is NULL_CONTEXT
+    assert span('stage') is NULL_CONTEXT
+    assert not disabled.requested({'headers': [(b'x-trace', b'1')]})
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_disabled_tracing_skips_middleware(client, auth_header_admin, mocker):
+    requested = mocker.spy(tracer, 'requested')
+    sampled = mocker.spy(tracer, 'sampled')
+
+    response = await client.get('/bots', headers=auth_header_admin)
+
+    assert 'x-trace-id' not in response.headers
+    assert requested.call_count == 0
+    assert sampled.call_count == 0
+
+
+@pytest.mark.asyncio()
+async def test_slow_trace_written_off_loop(tmp_path, mocker):
+    path = tmp_path / 'traces.jsonl'
+    slow = Tracer(1.0, None, 0, str(path))
+    threads = []
+    write = slow.write
+    mocker.patch.object(
+        slow, 'write', lambda trace: threads.append(get_ident()) or write(trace)
+    )
+
+    with slow.trace('request'):
+        pass
+    await wait_for(path.exists)
+
+    assert threads and threads[0] != get_ident()
+    assert [r['name'] for r in read_traces(path)] == ['request']
+
+
+def test_fast_traces_are_not_logged(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    fast = Tracer(1.0, None, 10_000, str(path))
+
+    with fast.trace('request') as trace:
+        with span('stage'):
+            pass
+
+    assert [s['name'] for s in trace.spans] == ['stage']
+    assert not path.exists()
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('bot')
+async def test_header_enables_request_trace(
+    client, auth_header_admin, trace_log, mocker
+):
+    mocker.patch.object(tracer, 'header', b'x-trace')
+
+    response = await client.get('/bots', headers={**auth_header_admin, 'X-Trace': '1'})
+
+    untraced = await client.get('/bots', headers=auth_header_admin)
+    await wait_for(lambda: read_traces(trace_log))
+
+    assert 'x-trace-id' not in untraced.headers
+    [record] = read_traces(trace_log)
+    assert record['trace_id'] == response.headers['x-trace-id']
+    assert record['name'] == 'GET /bots'
+    assert record['attributes'] == {'status': 200}
+    names = {s['name'] for s in record['spans']}
+    assert {'auth.jwt_decode', 'db.query'} <= names
+
+
+@pytest.mark.asyncio()
+@pytest.mark.usefixtures('_hello_message')
+async def test_sampled_websocket_message_trace(
+    client, auth_header_admin, trace_log, mocker
+):
+    mocker.patch.object(tracer, 'sample_rate', 1.0)
+
+    async with client.websocket_connect('/ws/1', headers=auth_header_admin) as ws:
+        await ws.send_text('Hello')
+        await ws.receive_text()
+        await ws.receive_text()
+        await wait_for(
+            lambda: any(r['name'] == 'ws.message' for r in read_traces(trace_log))
+        )
+
+    [record] = [r for r in read_traces(trace_log) if r['name'] == 'ws.message']
+    assert record['attributes'] == {'bot_id': 1, 'user_id': 1, 'size': 1}
+    names = [s['name'] for s in record['spans']]
+    assert {'command_index.load', 'match', 'redis.publish_to_redis'} <= set(names)